@@ -0,0 +1,86 @@
+'''
+Compares the IK solvers on random reachable targets of the left arm.
+
+Run from the src directory:
+    python -m benchmarks.ik_solvers
+'''
+
+import time
+import numpy as np
+from model.inverse_kinematics import InverseKinematics
+from model.robot import build_model, arm_inverse_kinematics, arm_source_element, hand_target_name, \
+    ARM_SOURCE_CONNECTION_POINT
+
+
+def random_reachable_targets(model, side, n_targets, seed=0):
+    '''
+    Targets produced by forward kinematics of random joint angles, so all of them are reachable
+    '''
+    random = np.random.default_rng(seed)
+    ik = arm_inverse_kinematics(model, side)
+    params, chain, _ = ik.prepare()
+    return chain.evaluate(random.uniform(-1.0, 1.0, size=(n_targets, len(params))))
+
+
+def residual(model, side, position):
+    '''
+    :return: distance of the hand to the requested position, not to the model's copy of it
+    '''
+    model.calc_coords()
+    source = model.get(arm_source_element(side)).get_connection_point_mapped_vector(ARM_SOURCE_CONNECTION_POINT)
+    return np.linalg.norm(source.flatten() - np.asarray(position, dtype=float), ord=2)
+
+
+def run(solver, targets, side='left', **search_kwargs):
+    times = []
+    residuals = []
+    for position in targets:
+        model = build_model()
+        model.get(hand_target_name(side)).set_position(position)
+        ik = arm_inverse_kinematics(model, side, seed=0, solver=solver)
+        start = time.perf_counter()
+        ik.search(apply=True, **search_kwargs)
+        times.append(time.perf_counter() - start)
+        residuals.append(residual(model, side, position))
+    return np.array(times), np.array(residuals)
+
+
+def phase_split(solver, targets, side='left', self_collision=False, **search_kwargs):
+    '''
+    :return: mean time per search in seconds, and the mean time per search of every phase
+    (see SearchStats)
+    '''
+    model = build_model()
+    stats = []
+    ik = arm_inverse_kinematics(model, side, seed=0, solver=solver, self_collision=self_collision,
+                                stats_callback=stats.append)
+    target = model.get(hand_target_name(side))
+    for position in targets:
+        target.set_position(position)
+        ik.search(**search_kwargs)
+    phases = {}
+    for s in stats:
+        for name, t in s.phase_times.items():
+            phases[name] = phases.get(name, 0.0) + t / len(stats)
+    return np.mean([s.total_time for s in stats]), phases
+
+
+def main(n_targets=50):
+    targets = random_reachable_targets(build_model(), 'left', n_targets)
+    print('%-9s %12s %14s %14s' % ('solver', 'mean ms', 'mean residual', 'max residual'))
+    for solver in InverseKinematics.SOLVERS:
+        times, residuals = run(solver, targets)
+        print('%-9s %12.3f %14.3f %14.3f' % (solver, times.mean() * 1000, residuals.mean(), residuals.max()))
+
+    print()
+    print('%-9s %-14s %9s  %s' % ('solver', 'self collision', 'mean ms', 'phases (ms, share of the search)'))
+    for solver in InverseKinematics.SOLVERS:
+        for self_collision in (False, True):
+            total, phases = phase_split(solver, targets, self_collision=self_collision)
+            print('%-9s %-14s %9.3f  %s' % (solver, self_collision, total * 1000,
+                                            ', '.join('%s %.3f (%.0f%%)' % (name, t * 1000, t / total * 100)
+                                                      for name, t in sorted(phases.items()))))
+
+
+if __name__ == '__main__':
+    main()
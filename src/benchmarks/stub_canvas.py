@@ -0,0 +1,44 @@
+class StubCanvas(object):
+    '''
+    Stands in for a Tk canvas in headless benchmarks: records the draw calls instead of drawing
+    '''
+    def __init__(self, width=500, height=300):
+        self.width = width
+        self.height = height
+        self.calls = {}
+        self.n_items = 0
+
+    def _record(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def bind(self, sequence, func):
+        pass
+
+    def after(self, ms, func):
+        self._record('after')
+        return None
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def delete(self, *items):
+        self._record('delete')
+
+    def create_line(self, *coords, **kwargs):
+        self._record('create_line')
+        self.n_items += 1
+        return self.n_items
+
+    def create_oval(self, *coords, **kwargs):
+        self._record('create_oval')
+        self.n_items += 1
+        return self.n_items
+
+    def coords(self, item, *coords):
+        self._record('coords')
+
+    def itemconfigure(self, item, **kwargs):
+        self._record('itemconfigure')
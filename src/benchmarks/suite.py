@@ -0,0 +1,187 @@
+'''
+Benchmarks of the forward kinematics, inverse kinematics and rendering hot paths, on the gui
+robot and on larger variants of it, written as json for regression tracking.
+
+Run from the src directory:
+    python -m benchmarks.suite [--output results.json] [--quick]
+'''
+
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+from model.robot import build_model, arm_inverse_kinematics, hand_target_name
+from model.shapes import get_robot_arm
+from model.batch_kinematics import BatchForwardKinematics
+from gui.canvas_3d import Canvas3D
+from gui.offscreen import OffscreenRenderer
+from benchmarks.stub_canvas import StubCanvas
+
+
+def build_scaled_model(n_extra_arms):
+    '''
+    The gui robot with additional arms attached along the body
+    '''
+    model = build_model()
+    body = model.get('body')
+    for i in range(n_extra_arms):
+        name = 'extra_arm' + str(i)
+        body.add_connection_point(name, np.array([-80 + 20 * i, 0, 0]))
+        body.add(get_robot_arm(name), connection_point=name)
+    return model
+
+
+def measure(f, repeat=5, number=None, min_time=0.05):
+    '''
+    :return: median and minimum time per call of f over repeat runs, in microseconds
+    '''
+    if number is None:
+        number = 1
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            number = max(1, int(min_time / elapsed))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            f()
+        times.append((time.perf_counter() - start) / number * 1e6)
+    return float(np.median(times)), float(np.min(times)), number
+
+
+def bench_fk(model_sizes):
+    results = []
+    for n_extra_arms in model_sizes:
+        model = build_scaled_model(n_extra_arms)
+        n_elements = sum(1 for _ in model.traverse_model())
+        joint = model.get('body.left_arm.shoulder_joint1')
+
+        def full():
+            model.mark_dirty()
+            model.calc_coords()
+
+        def incremental():
+            joint.angle += 0.001
+            model.calc_coords()
+
+        legacy = build_scaled_model(n_extra_arms)
+        legacy.compiled = False
+
+        for name, f in (('fk_compiled_full', full),
+                        ('fk_compiled_incremental', incremental),
+                        ('fk_recursive', legacy.calc_coords)):
+            median, best, number = measure(f)
+            results.append({'benchmark': name,
+                            'params': {'extra_arms': n_extra_arms, 'elements': n_elements},
+                            'median_us': median, 'min_us': best, 'number': number})
+
+        # per instance, for a batch of instances with random poses
+        n_instances = 1000
+        batch = BatchForwardKinematics(model)
+        angles = np.random.default_rng(0).uniform(-np.pi, np.pi, size=(n_instances, len(batch.joint_names)))
+        median, best, number = measure(lambda: batch.positions(angles))
+        results.append({'benchmark': 'fk_batch',
+                        'params': {'extra_arms': n_extra_arms, 'elements': n_elements, 'instances': n_instances},
+                        'median_us': median / n_instances, 'min_us': best / n_instances, 'number': number})
+    return results
+
+
+def bench_ik(beam_sizes, iteration_counts, n_targets=10):
+    random = np.random.default_rng(0)
+    targets = random.uniform([-50, -50, 50], [100, 50, 150], size=(n_targets, 3))
+    results = []
+
+    def run(solver, **search_kwargs):
+        model = build_model()
+        ik = arm_inverse_kinematics(model, 'left', seed=0, solver=solver)
+        target = model.get(hand_target_name('left'))
+        i = [0]
+
+        def f():
+            target.set_position(targets[i[0] % n_targets])
+            i[0] += 1
+            ik.search(**search_kwargs)
+        return measure(f, number=n_targets)
+
+    for beam_size in beam_sizes:
+        for max_iterations in iteration_counts:
+            params = {'beam_size': beam_size, 'n_next_steps': beam_size, 'max_iterations': max_iterations}
+            median, best, number = run('beam', early_stop=None, **params)
+            results.append({'benchmark': 'ik_beam', 'params': params,
+                            'median_us': median, 'min_us': best, 'number': number})
+    for max_iterations in iteration_counts:
+        params = {'max_iterations': max_iterations}
+        median, best, number = run('dls', **params)
+        results.append({'benchmark': 'ik_dls', 'params': params,
+                        'median_us': median, 'min_us': best, 'number': number})
+    median, best, number = run('analytic')
+    results.append({'benchmark': 'ik_analytic', 'params': {},
+                    'median_us': median, 'min_us': best, 'number': number})
+    return results
+
+
+def bench_render(model_sizes):
+    results = []
+    for n_extra_arms in model_sizes:
+        model = build_scaled_model(n_extra_arms)
+        canvas = StubCanvas()
+        canvas3d = Canvas3D(model, canvas)
+        canvas3d.redraw()
+        canvas.calls = {}
+
+        def rotate():
+            canvas3d.view_angle_y_axis += 0.01
+            canvas3d.redraw()
+
+        median, best, number = measure(rotate)
+        canvas.calls = {}
+        rotate()
+        results.append({'benchmark': 'render_redraw',
+                        'params': {'extra_arms': n_extra_arms},
+                        'median_us': median, 'min_us': best, 'number': number,
+                        'canvas_calls_per_frame': canvas.calls})
+
+        renderer = OffscreenRenderer(model)
+        image = renderer.render()
+
+        def rotate_offscreen():
+            renderer.view_angle_y_axis += 0.01
+            renderer.render(image)
+
+        median, best, number = measure(rotate_offscreen)
+        results.append({'benchmark': 'render_offscreen',
+                        'params': {'extra_arms': n_extra_arms, 'width': renderer.width, 'height': renderer.height},
+                        'median_us': median, 'min_us': best, 'number': number})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=None, help='json file to write the results to')
+    parser.add_argument('--quick', action='store_true', help='fewer variants, for smoke testing')
+    args = parser.parse_args()
+
+    if args.quick:
+        model_sizes, beam_sizes, iteration_counts = [0], [10], [20]
+    else:
+        model_sizes, beam_sizes, iteration_counts = [0, 2, 8], [5, 10, 20], [10, 20, 50]
+
+    results = bench_fk(model_sizes) + bench_ik(beam_sizes, iteration_counts) + bench_render(model_sizes)
+    for r in results:
+        print('%-24s %-60s %12.1f us' % (r['benchmark'], json.dumps(r['params']), r['median_us']))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version,
+                       'numpy': np.__version__,
+                       'platform': platform.platform(),
+                       'processor': platform.processor(),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+'''
+Fixed rate control loop, independent of the gui.
+
+Every tick reads the latest targets, solves inverse kinematics for them on the loop's own model,
+and publishes the joint commands to a ServoChannel (see hardware.servo). Ticks are scheduled on
+an absolute grid of the period. The IK searches of a tick get a deadline (see
+InverseKinematics.search) so the tick fits its period, and a tick that runs late anyway is not
+made up for: the ticks it overran are skipped rather than run back to back.
+
+The loop records how late every tick starts (jitter) and by how much the late ticks missed their
+deadline, the start of the next tick, as histograms. Observers, e.g. the gui (see
+gui.control_observer), are called with the published angles after every tick.
+
+Run it with asyncio.run(loop.run()), or on a background thread with start().
+'''
+
+import asyncio
+import threading
+import time
+import numpy as np
+
+# histogram bin edges in milliseconds
+DEFAULT_EDGES = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    '''
+    Counts of values in fixed bins: below edges[0], between consecutive edges, and from edges[-1] up
+    '''
+    def __init__(self, edges=DEFAULT_EDGES):
+        self.edges = np.array(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.total = 0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[np.searchsorted(self.edges, value, side='right')] += 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def labels(self):
+        edges = ['%g' % e for e in self.edges]
+        return ['<' + edges[0]] + [a + '-' + b for a, b in zip(edges, edges[1:])] + ['>=' + edges[-1]]
+
+    def as_dict(self):
+        return {'edges': self.edges.tolist(),
+                'counts': self.counts.tolist(),
+                'total': self.total,
+                'max': self.max}
+
+    def __str__(self):
+        return ' '.join('%s:%d' % (label, count) for label, count in zip(self.labels(), self.counts) if count > 0)
+
+
+class ControlLoop(object):
+    def __init__(self, model, solvers, servo=None, rate=100.0, ik_budget=0.8, target_source=None,
+                 spin=0.001, **search_kwargs):
+        '''
+        :param model: the model the loop solves on, owned by the loop while it runs (the gui
+        should observe a model of its own)
+        :param solvers: InverseKinematics on the model, one per target, solved in this order
+        :param servo: ServoChannel to publish the joint commands to, one frame per tick. It is
+        ticked by the loop, so it should not be started itself
+        :param rate: ticks per second
+        :param ik_budget: fraction of the period the IK searches of a tick may take together
+        :param target_source: optional callable polled every tick, returning a dict of target name
+        to position (targets left out stay where they are)
+        :param spin: seconds before a tick to stop sleeping and only yield to the event loop until
+        the tick is due, since sleeps wake up late by up to a millisecond or so. 0 saves the CPU
+        :param search_kwargs: passed on to InverseKinematics.search
+        '''
+        self.model = model
+        self.solvers = list(solvers)
+        self.servo = servo
+        self.rate = rate
+        self.ik_budget = ik_budget
+        self.target_source = target_source
+        self.spin = spin
+        self.search_kwargs = search_kwargs
+        self.joint_names = sorted(set().union(*(s.joint_names for s in self.solvers)))
+        self.observers = []
+
+        # latest target positions set from other threads, see set_target
+        self.lock = threading.Lock()
+        self.pending_targets = {}
+
+        self.jitter = Histogram()
+        self.deadline_misses = Histogram()
+        self.ticks = 0
+        self.ticks_skipped = 0
+        self.searches_skipped = 0
+        self.stop_reasons = {}
+
+        self.running = False
+        self.thread = None
+
+    def add_observer(self, observer):
+        '''
+        :param observer: called on the loop's thread after every tick with the tick number and a
+        dict of joint name to published angle. It should return quickly
+        '''
+        self.observers.append(observer)
+
+    def set_target(self, name, position):
+        '''
+        Move a target from any thread. Only the latest position per target is used, by the next tick
+        '''
+        with self.lock:
+            self.pending_targets[name] = np.array(position, dtype=float).reshape((3,))
+
+    def _read_targets(self):
+        with self.lock:
+            targets = self.pending_targets
+            self.pending_targets = {}
+        if self.target_source is not None:
+            targets.update(self.target_source() or {})
+        for name, position in targets.items():
+            self.model.get(name).set_position(position)
+
+    def tick(self, deadline=None):
+        '''
+        Read the targets, solve and publish once
+        :param deadline: time.monotonic() by which the IK searches have to finish, or None
+        '''
+        self._read_targets()
+        for i, solver in enumerate(self.solvers):
+            search_deadline = None
+            if deadline is not None:
+                # an equal share of the time left for every search left
+                search_deadline = (deadline - time.monotonic()) * 1000 / (len(self.solvers) - i)
+                if search_deadline <= 0:
+                    # no time left, keep the last command of these joints
+                    self.searches_skipped += 1
+                    continue
+            result = solver.search(apply=True, deadline=search_deadline, **self.search_kwargs)
+            stop_reason = solver.last_stats.stop_reason
+            self.stop_reasons[stop_reason] = self.stop_reasons.get(stop_reason, 0) + 1
+            if result is not None and self.servo is not None:
+                self.servo.set_from_params(result)
+        if self.servo is not None:
+            # joints not solved yet (e.g. searches skipped on the first ticks) hold the model's pose
+            self.servo.set_from_model(self.model, uncommanded_only=True)
+            self.servo.tick()
+        angles = {name: self.model.get(name).angle for name in self.joint_names}
+        for observer in self.observers:
+            observer(self.ticks, angles)
+        self.ticks += 1
+
+    async def run(self, n_ticks=None):
+        '''
+        Tick at the fixed rate until stop() is called, or for n_ticks ticks (skipped ones included)
+        '''
+        period = 1.0 / self.rate
+        self.running = True
+        next_tick = time.monotonic()
+        scheduled = 0
+        while self.running and (n_ticks is None or scheduled < n_ticks):
+            now = time.monotonic()
+            if now < next_tick - self.spin:
+                await asyncio.sleep(next_tick - self.spin - now)
+            while time.monotonic() < next_tick:
+                await asyncio.sleep(0)
+            now = time.monotonic()
+            self.jitter.add((now - next_tick) * 1000)
+            self.tick(deadline=next_tick + self.ik_budget * period)
+            next_tick += period
+            scheduled += 1
+
+            late = time.monotonic() - next_tick
+            if late > 0:
+                self.deadline_misses.add(late * 1000)
+                # the ticks which should have started meanwhile are dropped
+                skipped = int(np.ceil(late / period))
+                self.ticks_skipped += skipped
+                scheduled += skipped
+                next_tick += skipped * period
+        self.running = False
+
+    def start(self):
+        '''
+        Run the loop on a background thread with an event loop of its own
+        '''
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.run()), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def stats(self):
+        return {'ticks': self.ticks,
+                'ticks_skipped': self.ticks_skipped,
+                'searches_skipped': self.searches_skipped,
+                'stop_reasons': dict(self.stop_reasons),
+                'jitter_ms': self.jitter.as_dict(),
+                'deadline_miss_ms': self.deadline_misses.as_dict()}
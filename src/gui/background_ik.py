@@ -0,0 +1,68 @@
+import queue
+import threading
+import traceback
+
+
+class BackgroundInverseKinematics(object):
+    '''
+    Runs the IK searches of a solver on a worker thread, so the Tk loop never blocks on them.
+    Every search runs against a snapshot of the solver view (joint angles, kinematic chain and
+    target, see InverseKinematics.snapshot_view) taken when it was submitted, and its
+    result is applied back to the model on the Tk thread. A search superseded by a newer
+    submission is skipped if it has not started yet, and its result is dropped otherwise.
+    A search which raises is reported and has no result, the worker goes on with the next one.
+    '''
+    def __init__(self, widget, model, inverse_kinematics, on_applied=None, poll_interval=10,
+                 **search_kwargs):
+        '''
+        :param widget: any Tk widget, used to schedule polling for results on the Tk thread
+        :param on_applied: called on the Tk thread after a result was applied to the model
+        :param poll_interval: milliseconds between polls for results
+        :param search_kwargs: passed on to InverseKinematics.search
+        '''
+        self.widget = widget
+        self.model = model
+        self.inverse_kinematics = inverse_kinematics
+        self.on_applied = on_applied
+        self.poll_interval = poll_interval
+        self.search_kwargs = search_kwargs
+
+        self.generation = 0
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+        self.widget.after(self.poll_interval, self._poll)
+
+    def submit(self):
+        '''
+        Solve for the current state of the model, superseding any earlier submission
+        '''
+        self.generation += 1
+        self.requests.put((self.generation, self.inverse_kinematics.snapshot_view()))
+
+    def _work(self):
+        while True:
+            request = self.requests.get()
+            # only the latest request matters
+            while not self.requests.empty():
+                request = self.requests.get()
+            generation, view = request
+            try:
+                result = self.inverse_kinematics.search(apply=False, view=view, **self.search_kwargs)
+            except Exception:
+                traceback.print_exc()
+                result = None
+            self.results.put((generation, result))
+
+    def _poll(self):
+        applied = False
+        while not self.results.empty():
+            generation, result = self.results.get()
+            if generation == self.generation and result is not None:
+                for p in result:
+                    p.apply_to_model(self.model)
+                applied = True
+        if applied and self.on_applied is not None:
+            self.on_applied()
+        self.widget.after(self.poll_interval, self._poll)
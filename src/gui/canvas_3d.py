@@ -1,19 +1,41 @@
 import math
+import time
 import numpy as np
+from model.skeleton_model import Shape, RotationJoint, Target
 from model.transformations import *
 
 class Canvas3D(object):
-    def __init__(self, model, canvas):
+    '''
+    Retained mode 3d view of a model: canvas items are created once per shape edge, joint and
+    target, and only moved on redraw. The camera, perspective and viewport transforms are fused
+    into a single projective matrix, applied to all vertices of a shape in one operation.
+    Redraw requests are coalesced into at most one frame per frame interval
+    '''
+    def __init__(self, model, canvas, frame_interval=16):
+        '''
+        :param frame_interval: minimal time between frames, in milliseconds
+        '''
         self.model = model
         self.canvas = canvas
         self.view_angle_x_axis = 0.2
         self.view_angle_y_axis = - math.pi / 4
         self.frame_size = 300
+        self.camera_distance = 300
+        self.focal_distance = 300
 
         self.drag_origin_xy = None
         self.view_angle_origin_xy = None
 
-        canvas.bind("<Configure>", lambda e: self.redraw())
+        self.frame_interval = frame_interval
+        self.pending_frame = None
+        self.last_frame_time = None
+
+        # canvas items, rebuilt when the model structure changes
+        self.items_structure_version = None
+        self.shape_items = []
+        self.point_items = []
+
+        canvas.bind("<Configure>", lambda e: self.request_redraw())
         canvas.bind("<ButtonPress-1>", lambda e: self.drag_set_origin_xy(e))
         canvas.bind("<B1-Motion>", lambda e: self.drag_rotate_canvas(e))
 
@@ -28,30 +50,86 @@ class Canvas3D(object):
         self.view_angle_x_axis, self.view_angle_y_axis = self.view_angle_origin_xy
         self.view_angle_x_axis += drag_y / 100
         self.view_angle_y_axis -= drag_x / 100
+        self.request_redraw()
+
+    def request_redraw(self):
+        '''
+        Schedule a redraw on the Tk event loop. Requests made before the scheduled frame is
+        drawn are served by it
+        '''
+        if self.pending_frame is not None:
+            return
+        delay = 0
+        if self.last_frame_time is not None:
+            elapsed = (time.monotonic() - self.last_frame_time) * 1000
+            delay = max(0, int(self.frame_interval - elapsed))
+        self.pending_frame = self.canvas.after(delay, self._draw_frame)
+
+    def _draw_frame(self):
+        self.pending_frame = None
+        self.last_frame_time = time.monotonic()
         self.redraw()
 
+    def view_matrix(self, canvas_width, canvas_height):
+        '''
+        :return: 3x4 projective matrix taking model coordinates to homogeneous display
+        coordinates (x * w, y * w, w), where w is the depth in front of the camera
+        '''
+        scale_factor = np.min([canvas_height, canvas_width]) / self.frame_size
+        camera = Transform.translation(np.array([0, 0, self.camera_distance])) @ \
+            Transform.rotation(np.array([1, 0, 0]), self.view_angle_x_axis) @ \
+            Transform.rotation(np.array([0, 1, 0]), self.view_angle_y_axis)
+        projection = np.array([[scale_factor * self.focal_distance, 0, canvas_width / 2, 0],
+                               [0, scale_factor * self.focal_distance, canvas_height / 2, 0],
+                               [0, 0, 1, 0]])
+        return np.dot(projection, camera.matrix)
+
+    @staticmethod
+    def project(matrix, points):
+        '''
+        :return: (n, 2) display coordinates of the points, and a mask of the points in front
+        of the camera
+        '''
+        projected = np.dot(points, matrix[:, :3].T) + matrix[:, 3]
+        depth = projected[:, 2:3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return projected[:, :2] / depth, depth[:, 0] > 0
+
+    def build_items(self):
+        self.canvas.delete("all")
+        self.shape_items = []
+        self.point_items = []
+        for element, _ in self.model.traverse_model():
+            if isinstance(element, Shape):
+                edges = np.array(element.lines, dtype=int).reshape((-1, 2))
+                items = [self.canvas.create_line(0, 0, 0, 0, state='hidden') for _ in range(len(edges))]
+                self.shape_items.append((element, edges, items, np.zeros(len(edges), dtype=bool)))
+            elif isinstance(element, RotationJoint):
+                self.point_items.append((element, 'origin', 2, self.canvas.create_oval(0, 0, 0, 0)))
+            elif isinstance(element, Target):
+                self.point_items.append((element, 'position', 4, self.canvas.create_oval(0, 0, 0, 0)))
+        self.items_structure_version = self.model.structure_version
 
     def redraw(self):
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
-        scale_factor = np.min([canvas_height, canvas_width]) / self.frame_size
 
-        self.canvas.delete("all")
+        if self.items_structure_version != self.model.structure_version:
+            self.build_items()
         self.model.calc_coords()
+        matrix = self.view_matrix(canvas_width, canvas_height)
+
+        for element, edges, items, shown in self.shape_items:
+            screen, visible = self.project(matrix, element.mapped_vectors['vertices'])
+            coords = screen[edges].reshape((-1, 4)).tolist()
+            visible = visible[edges].all(axis=1)
+            for i in np.nonzero(visible != shown)[0]:
+                self.canvas.itemconfigure(items[i], state='normal' if visible[i] else 'hidden')
+            shown[:] = visible
+            for i in np.nonzero(visible)[0]:
+                self.canvas.coords(items[i], coords[i])
 
-        # camera transforms
-        self.model.transform_mapped(get_rotation_transform(np.array([0, 1, 0]),
-                                                           self.view_angle_y_axis))
-        self.model.transform_mapped(get_rotation_transform(np.array([1, 0, 0]),
-                                                           self.view_angle_x_axis))
-        self.model.transform_mapped(get_translation_transform(np.array([0, 0, 300])))
-        self.model.transform_mapped(get_fake_perspective_transform(300))
-
-        # fit to display coords
-        self.model.transform_mapped(get_scale_transform(np.array([scale_factor, scale_factor, scale_factor])))
-        self.model.transform_mapped(get_translation_transform(np.array([canvas_width / 2, canvas_height / 2, 0])))
-
-        self.model.draw(self.canvas)
-        # view_angle += math.pi / 300
-        # joint1.angle += math.pi / 100
-        #self.model.get('body.left_arm.shoulder_joint').angle += math.pi / 50
+        for element, vector_name, radius, item in self.point_items:
+            screen, _ = self.project(matrix, element.mapped_vectors[vector_name])
+            x, y = screen[0].tolist()
+            self.canvas.coords(item, x - radius, y - radius, x + radius, y + radius)
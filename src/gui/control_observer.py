@@ -0,0 +1,51 @@
+import threading
+
+
+class ControlLoopObserver(object):
+    '''
+    Shows a running ControlLoop (see control.loop) in the gui. The joint angles published by the
+    loop are mirrored into the gui's model on the Tk thread, only the latest ones if several ticks
+    passed between polls. Stands in for BackgroundInverseKinematics in TargetControl: submit sends
+    the gui's target positions to the loop instead of solving for them here.
+    '''
+    def __init__(self, widget, model, control_loop, on_applied=None, poll_interval=20):
+        '''
+        :param widget: any Tk widget, used to schedule polling on the Tk thread
+        :param model: the gui's model, not the loop's
+        :param on_applied: called on the Tk thread after new angles were applied to the model
+        :param poll_interval: milliseconds between polls
+        '''
+        self.widget = widget
+        self.model = model
+        self.control_loop = control_loop
+        self.on_applied = on_applied
+        self.poll_interval = poll_interval
+
+        self.lock = threading.Lock()
+        self.latest = None
+        self.control_loop.add_observer(self._observe)
+        self.widget.after(self.poll_interval, self._poll)
+
+    def submit(self):
+        '''
+        Send the current positions of the loop's targets in the gui's model to the loop
+        '''
+        for solver in self.control_loop.solvers:
+            target = self.model.get(solver.target_name)
+            self.control_loop.set_target(solver.target_name, target.vectors['position'])
+
+    def _observe(self, tick, angles):
+        # on the loop's thread
+        with self.lock:
+            self.latest = angles
+
+    def _poll(self):
+        with self.lock:
+            angles = self.latest
+            self.latest = None
+        if angles is not None:
+            for name, angle in angles.items():
+                self.model.get(name).angle = angle
+            if self.on_applied is not None:
+                self.on_applied()
+        self.widget.after(self.poll_interval, self._poll)
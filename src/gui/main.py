@@ -1,52 +1,58 @@
+import argparse
+import copy
+import os
 from tkinter import *
-from model.skeleton_model import *
-from model.shapes import *
 from gui.canvas_3d import Canvas3D
 from gui.target_control import TargetControl
-from model.inverse_kinematics import InverseKinematics
+from gui.background_ik import BackgroundInverseKinematics
+from gui.control_observer import ControlLoopObserver
+from model.robot import build_model, arm_inverse_kinematics, hand_target_name, all_joint_names
+from model.ik_cache import SolutionCache
+from model.snapshot import save_snapshot, load_snapshot
+from control.loop import ControlLoop
+from hardware.servo import ServoChannel
 
-def build_model():
-    model = Model()
-    body = get_robot_body('body')
-    right_arm = get_robot_arm('right_arm')
-    left_arm = get_robot_arm('left_arm')
+parser = argparse.ArgumentParser()
+parser.add_argument('snapshot', nargs='?', default=None,
+                    help='snapshot of the solved model (see model.snapshot), loaded if it exists, else written')
+parser.add_argument('--control-rate', type=float, default=None,
+                    help='run the control loop (see control.loop) at this many ticks per second, the gui '
+                         'only observes it')
+parser.add_argument('--servo-port', default=None, help='serial port the control loop sends joint commands to')
+parser.add_argument('--ik-stats', action='store_true',
+                    help='print the stats of every IK search of the gui (see model.ik_stats)')
+args = parser.parse_args()
 
-    model.add(body)
-    body.add(right_arm, connection_point='right_arm')
-    body.add(left_arm, connection_point='left_arm')
+snapshot_path = args.snapshot
+loaded = snapshot_path is not None and os.path.exists(snapshot_path)
 
-    target_left = Target([0, 0, 100], name='left_hand_target')
-    target_right = Target([0, 0, -100], name='right_hand_target')
-    model.add(target_left)
-    model.add(target_right)
-    return model
+model = load_snapshot(snapshot_path)[0] if loaded else build_model()
+ik_cache = SolutionCache()
+ik_stats_callback = print if args.ik_stats else None
 
-model = build_model()
+ik_left = arm_inverse_kinematics(model, 'left', solver='analytic', cache=ik_cache,
+                                 self_collision=True, stats_callback=ik_stats_callback)
+ik_right = arm_inverse_kinematics(model, 'right', solver='analytic', cache=ik_cache,
+                                  self_collision=True, stats_callback=ik_stats_callback)
+if not loaded:
+    solutions = {hand_target_name('left'): ik_left.search(apply=True),
+                 hand_target_name('right'): ik_right.search(apply=True)}
+    if snapshot_path is not None:
+        save_snapshot(model, snapshot_path, solutions=solutions)
 
-left_arm_target_name = 'body.left_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3.upper_arm.elbow_joint.lower_arm'
-left_arm_target_connection_point = 'joint'
-left_arm_joint_names = {'body.left_arm.shoulder_joint1',
-                        'body.left_arm.shoulder_joint1.shoulder_joint2',
-                        'body.left_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3',
-                        'body.left_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3.upper_arm.elbow_joint'}
-ik_left = InverseKinematics(model, left_arm_target_name,
-                            left_arm_target_connection_point,
-                            'left_hand_target',
-                            joint_names=left_arm_joint_names)
-ik_left.search(apply=True)
-
-
-right_arm_target_name = 'body.right_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3.upper_arm.elbow_joint.lower_arm'
-right_arm_target_connection_point = 'joint'
-right_arm_joint_names = {'body.right_arm.shoulder_joint1',
-                         'body.right_arm.shoulder_joint1.shoulder_joint2',
-                         'body.right_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3',
-                         'body.right_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3.upper_arm.elbow_joint'}
-ik_right = InverseKinematics(model, right_arm_target_name,
-                             right_arm_target_connection_point,
-                             'right_hand_target',
-                             joint_names=right_arm_joint_names)
-ik_right.search(apply=True)
+control_loop = None
+if args.control_rate is not None:
+    # the loop solves on a model of its own, the gui's model mirrors it
+    control_model = copy.deepcopy(model)
+    servo = None
+    if args.servo_port is not None:
+        servo = ServoChannel.open(args.servo_port, {n: i for i, n in enumerate(all_joint_names())})
+    control_loop = ControlLoop(control_model,
+                               [arm_inverse_kinematics(control_model, side, solver='dls', self_collision=True)
+                                for side in ('left', 'right')],
+                               servo=servo,
+                               rate=args.control_rate,
+                               max_iterations=20)
 
 master = Tk()
 master.title("ROBOT Control")
@@ -61,7 +67,18 @@ master.columnconfigure(0, weight=1)
 master.rowconfigure(4, weight=1)
 
 canvas3d = Canvas3D(model, canvas)
-canvas3d.redraw()
+canvas3d.request_redraw()
+
+control_observer = None
+if control_loop is not None:
+    control_observer = ControlLoopObserver(master, model, control_loop, on_applied=canvas3d.request_redraw)
+
+
+def solver_for(ik):
+    if control_observer is not None:
+        return control_observer
+    return BackgroundInverseKinematics(master, model, ik, on_applied=canvas3d.request_redraw, max_iterations=20)
+
 
 target_control_frame_left = Frame()
 target_control_frame_left.grid(row=0, column=1, rowspan=1, columnspan=1)
@@ -69,7 +86,7 @@ target_control_left = TargetControl(target_control_frame_left,
                                     model,
                                     'left_hand_target',
                                     canvas3d,
-                                    ik_left)
+                                    solver_for(ik_left))
 
 target_control_frame_right = Frame()
 target_control_frame_right.grid(row=1, column=1, rowspan=1, columnspan=1)
@@ -77,6 +94,11 @@ target_control_right = TargetControl(target_control_frame_right,
                                      model,
                                      'right_hand_target',
                                      canvas3d,
-                                     ik_right)
+                                     solver_for(ik_right))
 
-mainloop()
\ No newline at end of file
+if control_loop is not None:
+    control_loop.start()
+mainloop()
+if control_loop is not None:
+    control_loop.stop()
+    print(control_loop.stats())
\ No newline at end of file
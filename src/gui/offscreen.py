@@ -0,0 +1,199 @@
+'''
+Offscreen rendering of a model into numpy images, without Tk, e.g. on headless machines.
+
+The camera is the one of Canvas3D (same view attributes, view matrix and projection), so frames
+look like the gui. All the mapped vertices of the model are projected at once from its
+VertexPool, and the edges of all shapes of a frame are clipped to the image and rasterized
+together: every edge is sampled at one point per pixel along its major axis, and all the
+samples are written into the image in a single fancy indexed assignment.
+
+Frames are plain (height, width) uint8 arrays. A trajectory is exported either as a directory of
+binary PGM files (which e.g. ffmpeg turns into a video) or as a single (frames, height, width)
+.npy file, written through a memory map.
+'''
+
+import math
+import os
+import numpy as np
+from model.skeleton_model import Shape, RotationJoint, Target
+from gui.canvas_3d import Canvas3D
+
+BACKGROUND = 255
+FOREGROUND = 0
+
+
+def clip_segments(start, end, width, height):
+    '''
+    Liang-Barsky clipping of 2d segments to the image, vectorized over the segments
+    :param start: (n, 2) first points, end: (n, 2) second points, in pixel coordinates
+    :return: the clipped start and end points, and a mask of the segments left
+    '''
+    delta = end - start
+    t0 = np.zeros(len(start))
+    t1 = np.ones(len(start))
+    keep = np.ones(len(start), dtype=bool)
+    for axis, size in ((0, width), (1, height)):
+        # inside is p * t <= q, for both the lower and the upper bound
+        for p, q in ((-delta[:, axis], start[:, axis]),
+                     (delta[:, axis], size - 1 - start[:, axis])):
+            keep &= (p != 0) | (q >= 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+    keep &= t0 <= t1
+    return start + t0[:, None] * delta, start + t1[:, None] * delta, keep
+
+
+def draw_segments(image, start, end, value=FOREGROUND):
+    '''
+    Rasterize 2d segments into the image, all at once
+    :param start: (n, 2) first points, end: (n, 2) second points, in pixel coordinates (x, y)
+    '''
+    height, width = image.shape[:2]
+    start, end, keep = clip_segments(start, end, width, height)
+    start, end = start[keep], end[keep]
+    delta = end - start
+    # one sample per pixel along the major axis, both ends included
+    n_samples = np.ceil(np.abs(delta).max(axis=1)).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(start)), n_samples)
+    first = np.cumsum(n_samples) - n_samples
+    step = np.arange(len(segment)) - np.repeat(first, n_samples)
+    t = step / np.maximum(n_samples - 1, 1)[segment]
+    points = np.rint(start[segment] + t[:, None] * delta[segment]).astype(np.int64)
+    x = np.clip(points[:, 0], 0, width - 1)
+    y = np.clip(points[:, 1], 0, height - 1)
+    image[y, x] = value
+
+
+def draw_circles(image, centers, radii, value=FOREGROUND):
+    '''
+    Rasterize circle outlines into the image, all at once
+    :param centers: (n, 2) centers in pixel coordinates (x, y), radii: (n,) radii in pixels
+    '''
+    height, width = image.shape[:2]
+    n_samples = int(math.ceil(2 * math.pi * np.max(radii, initial=0))) + 1
+    angles = np.linspace(0, 2 * math.pi, n_samples, endpoint=False)
+    offsets = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+    points = np.rint(centers[:, None, :] + radii[:, None, None] * offsets).reshape((-1, 2)).astype(np.int64)
+    inside = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+    image[points[inside, 1], points[inside, 0]] = value
+
+
+class OffscreenRenderer(object):
+    '''
+    Draws what Canvas3D draws, the shape edges and circles around joint origins and targets, into
+    a numpy image
+    '''
+    # the camera of Canvas3D, on the view attributes of this renderer
+    view_matrix = Canvas3D.view_matrix
+    project = staticmethod(Canvas3D.project)
+
+    def __init__(self, model, width=500, height=300):
+        self.model = model
+        self.width = width
+        self.height = height
+        self.view_angle_x_axis = 0.2
+        self.view_angle_y_axis = - math.pi / 4
+        self.frame_size = 300
+        self.camera_distance = 300
+        self.focal_distance = 300
+
+        # rows of the model's vertex pool, rebuilt when the model structure changes
+        self.structure_version = None
+        self.vertex_pool = None
+        self.edges = None
+        self.point_rows = None
+        self.point_radii = None
+
+    def _build(self):
+        vertex_pool = self.model.get_vertex_pool()
+        edges = []
+        point_rows = []
+        point_radii = []
+        for element, name, start, _ in vertex_pool.ranges:
+            if isinstance(element, Shape) and name == 'vertices':
+                edges.append(np.array(element.lines, dtype=np.int64).reshape((-1, 2)) + start)
+            elif isinstance(element, RotationJoint) and name == 'origin':
+                point_rows.append(start)
+                point_radii.append(2)
+            elif isinstance(element, Target) and name == 'position':
+                point_rows.append(start)
+                point_radii.append(4)
+        self.vertex_pool = vertex_pool
+        self.edges = np.concatenate(edges) if edges else np.zeros((0, 2), dtype=np.int64)
+        self.point_rows = np.array(point_rows, dtype=np.int64)
+        self.point_radii = np.array(point_radii, dtype=float)
+        self.structure_version = self.model.structure_version
+
+    def render(self, image=None):
+        '''
+        :param image: (height, width) uint8 array to draw into, a new one by default
+        :return: the image
+        '''
+        self.model.calc_coords()
+        if self.structure_version != self.model.structure_version or \
+                self.vertex_pool is not self.model.get_vertex_pool():
+            self._build()
+        if image is None:
+            image = np.empty((self.height, self.width), dtype=np.uint8)
+        image.fill(BACKGROUND)
+
+        matrix = self.view_matrix(self.width, self.height)
+        screen, visible = self.project(matrix, self.vertex_pool.mapped)
+        edges = self.edges[visible[self.edges].all(axis=1)]
+        draw_segments(image, screen[edges[:, 0]], screen[edges[:, 1]])
+        shown = visible[self.point_rows]
+        draw_circles(image, screen[self.point_rows[shown]], self.point_radii[shown])
+        return image
+
+    def render_trajectory(self, trajectory, fps=None):
+        '''
+        Generator of the frames of a trajectory (see model.trajectory), posing the model at every
+        waypoint or, with fps, at that many frames per second. The frame array is reused, so
+        frames have to be copied to be kept. The joints are put back where they were afterwards
+        '''
+        joints = [self.model.get(n) for n in trajectory.joint_names]
+        original = [j.angle for j in joints]
+        if fps is None:
+            poses = (angles for _, angles in trajectory.waypoints())
+        else:
+            times = np.arange(int(math.floor(trajectory.duration * fps)) + 1) / fps
+            poses = iter(trajectory.sample(times))
+        image = np.empty((self.height, self.width), dtype=np.uint8)
+        try:
+            for angles in poses:
+                for joint, angle in zip(joints, angles):
+                    joint.angle = float(angle)
+                yield self.render(image)
+        finally:
+            for joint, angle in zip(joints, original):
+                joint.angle = angle
+
+    def export_trajectory(self, trajectory, path, fps=None):
+        '''
+        Render all frames of a trajectory to path: a .npy file of (frames, height, width), or else
+        a directory of numbered PGM files
+        :return: number of frames written
+        '''
+        n_frames = len(trajectory) if fps is None else int(math.floor(trajectory.duration * fps)) + 1
+        if path.endswith('.npy'):
+            frames = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                               shape=(n_frames, self.height, self.width))
+            for i, image in enumerate(self.render_trajectory(trajectory, fps)):
+                frames[i] = image
+            frames.flush()
+            return n_frames
+        os.makedirs(path, exist_ok=True)
+        for i, image in enumerate(self.render_trajectory(trajectory, fps)):
+            write_pgm(os.path.join(path, 'frame_%05d.pgm' % i), image)
+        return n_frames
+
+
+def write_pgm(path, image):
+    '''
+    Write a (height, width) uint8 image as a binary PGM file
+    '''
+    with open(path, 'wb') as f:
+        f.write(b'P5\n%d %d\n255\n' % (image.shape[1], image.shape[0]))
+        f.write(np.ascontiguousarray(image).tobytes())
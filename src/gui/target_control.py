@@ -3,12 +3,15 @@ import numpy as np
 
 
 class TargetControl(object):
-    def __init__(self, container, model, target_name, canvas3d, inverse_kinematics):
+    def __init__(self, container, model, target_name, canvas3d, background_ik):
+        '''
+        :param background_ik: BackgroundInverseKinematics for the target
+        '''
         self.container = container
         self.model = model
         self.target_name = target_name
         self.canvas3d = canvas3d
-        self.inverse_kinematics = inverse_kinematics
+        self.background_ik = background_ik
 
         label = Label(container, text=target_name)
         label.grid(row=0, column=0, columnspan=3)
@@ -30,8 +33,7 @@ class TargetControl(object):
 
     def move_target(self, move_v):
         target = self.model.get(self.target_name)
-        v = target.vectors['position']
-        v[:] = v + np.array(move_v)
-        self.inverse_kinematics.search(max_iterations=20, apply=True)
+        target.set_position(target.vectors['position'] + np.array(move_v))
+        self.background_ik.submit()
 
-        self.canvas3d.redraw()
+        self.canvas3d.request_redraw()
@@ -0,0 +1,114 @@
+'''
+Binary framing shared by the serial links to the robot.
+
+Every frame is little endian and has a fixed size for a given format:
+    sync        2 bytes   0xA5 0x5A
+    frame_type  uint8
+    n_channels  uint8
+    seq         uint16    wraps around
+    fields      format specific, one value per channel for every field
+    checksum    uint16    Fletcher-16 of everything between sync and checksum
+
+Since the size is fixed, a whole buffer of frames is decoded at once: frame starts are found by
+vectorized sync and checksum tests, and the frames are reinterpreted as a numpy structured array.
+'''
+
+import numpy as np
+
+SYNC = b'\xa5\x5a'
+_HEADER_SIZE = 6
+_CHECKSUM_SIZE = 2
+
+FRAME_TELEMETRY = 1
+FRAME_COMMAND = 2
+
+
+def fletcher16(rows):
+    '''
+    :param rows: (n, k) uint8 array
+    :return: (n,) Fletcher-16 checksum of every row
+    '''
+    rows = rows.astype(np.int64)
+    k = rows.shape[1]
+    sum1 = rows.sum(axis=1) % 255
+    sum2 = np.dot(rows, np.arange(k, 0, -1)) % 255
+    return (sum2 << 8) | sum1
+
+
+class FrameFormat(object):
+    def __init__(self, frame_type, n_channels, fields, extra_fields=()):
+        '''
+        :param fields: (name, dtype) pairs, each holding one value per channel
+        :param extra_fields: (name, dtype) pairs holding a single value per frame, after the header
+        '''
+        self.frame_type = frame_type
+        self.n_channels = n_channels
+        self.dtype = np.dtype([('sync', '<u2'), ('frame_type', 'u1'), ('n_channels', 'u1'), ('seq', '<u2')] +
+                              [(name, dtype) for name, dtype in extra_fields] +
+                              [(name, dtype, (n_channels,)) for name, dtype in fields] +
+                              [('checksum', '<u2')])
+        self.size = self.dtype.itemsize
+        self.sync = np.frombuffer(SYNC, dtype='<u2')[0]
+
+    def encode(self, seq, **values):
+        '''
+        Encode a batch of frames
+        :param seq: (n,) sequence numbers
+        :param values: per field, an (n,) or (n, n_channels) array
+        :return: bytes of all n frames
+        '''
+        seq = np.atleast_1d(seq)
+        frames = np.zeros(len(seq), dtype=self.dtype)
+        frames['sync'] = self.sync
+        frames['frame_type'] = self.frame_type
+        frames['n_channels'] = self.n_channels
+        frames['seq'] = seq.astype(np.int64) & 0xffff
+        for name, value in values.items():
+            frames[name] = value
+        rows = frames.view(np.uint8).reshape((len(seq), self.size))
+        frames['checksum'] = fletcher16(rows[:, 2:-_CHECKSUM_SIZE])
+        return frames.tobytes()
+
+    def decode(self, buffer):
+        '''
+        Decode all complete frames in a buffer, skipping corrupt frames and garbage in between
+        :return: structured array of the frames, and the number of bytes consumed. The bytes
+        after that may hold the beginning of a frame and should be kept for the next call
+        '''
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        if len(data) < self.size:
+            return np.zeros(0, dtype=self.dtype), 0
+        last_start = len(data) - self.size
+        starts = np.nonzero((data[:last_start + 1] == SYNC[0]) & (data[1:last_start + 2] == SYNC[1]))[0]
+        rows = data[starts.reshape((-1, 1)) + np.arange(self.size)]
+        header_ok = (rows[:, 2] == self.frame_type) & (rows[:, 3] == self.n_channels)
+        checksums = rows[:, -2].astype(np.int64) | (rows[:, -1].astype(np.int64) << 8)
+        valid = header_ok & (fletcher16(rows[:, 2:-_CHECKSUM_SIZE]) == checksums)
+        starts = starts[valid]
+        rows = rows[valid]
+        if len(starts) > 1:
+            # a valid frame starting inside the previous one can only be a false match
+            keep = np.concatenate(([True], np.diff(starts) >= self.size))
+            starts = starts[keep]
+            rows = rows[keep]
+        consumed = last_start + 1
+        if len(starts) > 0:
+            consumed = max(consumed, starts[-1] + self.size)
+        return np.ascontiguousarray(rows).view(self.dtype).reshape((-1,)), int(consumed)
+
+
+def telemetry_format(n_channels):
+    '''
+    Robot to host: device timestamp in microseconds, then the measured joint angle (radians)
+    and raw encoder count of every channel
+    '''
+    return FrameFormat(FRAME_TELEMETRY, n_channels,
+                       [('angles', '<f4'), ('encoders', '<i4')],
+                       extra_fields=[('timestamp', '<u4')])
+
+
+def command_format(n_channels):
+    '''
+    Host to robot: the commanded angle (radians) of every servo channel
+    '''
+    return FrameFormat(FRAME_COMMAND, n_channels, [('angles', '<f4')])
@@ -0,0 +1,50 @@
+'''
+Raw, non-blocking access to serial ports (and pseudo terminals standing in for them) through
+plain file descriptors, so the links to the robot need nothing beyond the standard library.
+POSIX only.
+'''
+
+import os
+import termios
+import tty
+
+
+def open_serial_port(path, baudrate=None):
+    '''
+    Open a serial port in raw, non-blocking mode
+    :param baudrate: e.g. 115200, or None to keep the port's current speed
+    :return: file descriptor
+    '''
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        if baudrate is not None:
+            speed = getattr(termios, 'B' + str(baudrate), None)
+            if speed is None:
+                raise ValueError('unsupported baudrate: ' + str(baudrate))
+            attributes = termios.tcgetattr(fd)
+            attributes[4] = speed
+            attributes[5] = speed
+            termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+
+def read_available(fd, max_bytes=65536):
+    '''
+    :return: all bytes that can be read without blocking, up to max_bytes
+    '''
+    chunks = []
+    n = 0
+    while n < max_bytes:
+        try:
+            chunk = os.read(fd, max_bytes - n)
+        except BlockingIOError:
+            break
+        if not chunk:
+            break
+        chunks.append(chunk)
+        n += len(chunk)
+    return b''.join(chunks)
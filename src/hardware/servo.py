@@ -0,0 +1,149 @@
+'''
+Joint commands to the servo controllers.
+
+All commanded angles are packed into a single command frame (see hardware.framing) per tick,
+instead of one write per joint. Commands set between ticks are coalesced, only the latest angle
+of every joint is sent. No frame is sent before every channel was commanded, since a frame holds
+all channels and the ones nobody commanded would be driven to 0. Writes never block: when the
+port can not take a whole frame, the rest is kept and flushed on the next ticks, and new frames
+are dropped rather than queued meanwhile, since they would be stale by the time they are sent
+anyway.
+'''
+
+import os
+import threading
+import time
+import numpy as np
+from hardware.framing import command_format
+from hardware.serial_port import open_serial_port
+
+
+class ServoChannel(object):
+    def __init__(self, fd, channel_map, rate=50.0):
+        '''
+        :param fd: non-blocking file descriptor of the port, see ServoChannel.open
+        :param channel_map: dict of joint name to servo channel, channels are 0..n-1
+        :param rate: frames per second sent by start()
+        '''
+        self.fd = fd
+        self.channel_map = dict(channel_map)
+        n_channels = max(self.channel_map.values()) + 1 if self.channel_map else 0
+        if sorted(self.channel_map.values()) != list(range(n_channels)):
+            raise ValueError('servo channels should be 0..n-1, each used once')
+        self.frame_format = command_format(n_channels)
+        self.rate = rate
+        self.angles = np.zeros(n_channels, dtype=np.float32)
+        # channels commanded at all, and channels commanded since the last frame
+        self.commanded = np.zeros(n_channels, dtype=bool)
+        self.updated = np.zeros(n_channels, dtype=bool)
+        self.lock = threading.Lock()
+        self.pending = b''
+        self.seq = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.commands_coalesced = 0
+        self.thread = None
+        self.running = False
+
+    @staticmethod
+    def open(path, channel_map, baudrate=None, **kwargs):
+        return ServoChannel(open_serial_port(path, baudrate), channel_map, **kwargs)
+
+    def close(self):
+        self.stop()
+        os.close(self.fd)
+
+    def set_angles(self, angles, uncommanded_only=False):
+        '''
+        :param angles: dict of joint name to commanded angle, joints not in the channel map are ignored
+        :param uncommanded_only: only set the channels which were not commanded yet
+        '''
+        with self.lock:
+            for name, angle in angles.items():
+                channel = self.channel_map.get(name)
+                if channel is None or (uncommanded_only and self.commanded[channel]):
+                    continue
+                if self.updated[channel]:
+                    # the previous command of the channel was never sent
+                    self.commands_coalesced += 1
+                self.angles[channel] = angle
+                self.commanded[channel] = True
+                self.updated[channel] = True
+
+    def set_from_params(self, params):
+        '''
+        :param params: IK result, a set of RotationJointAngleParam
+        '''
+        self.set_angles({p.joint_name: p.angle for p in params})
+
+    def set_from_model(self, model, uncommanded_only=False):
+        '''
+        :param uncommanded_only: only set the channels which were not commanded yet, e.g. to hold
+        the current pose of joints nothing else commands
+        '''
+        if uncommanded_only and self.commanded.all():
+            return
+        self.set_angles({name: model.get(name).angle for name in self.channel_map}, uncommanded_only)
+
+    def tick(self):
+        '''
+        Send one frame with the latest commanded angles, unless some channel was not commanded yet
+        :return: True if a frame was started
+        '''
+        if self.pending:
+            self._flush()
+            if self.pending:
+                self.frames_dropped += 1
+                return False
+        with self.lock:
+            if not self.commanded.all():
+                return False
+            angles = np.copy(self.angles)
+            self.updated[:] = False
+        self.pending = self.frame_format.encode(self.seq, angles=angles.reshape((1, -1)))
+        self.seq += 1
+        self.frames_sent += 1
+        self._flush()
+        return True
+
+    def _flush(self):
+        try:
+            n = os.write(self.fd, self.pending)
+        except BlockingIOError:
+            n = 0
+        self.pending = self.pending[n:]
+
+    def start(self):
+        '''
+        Send frames at the fixed rate on a background thread. Ticks that are missed (e.g. while
+        the thread was not scheduled) are skipped, not sent late
+        '''
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        period = 1.0 / self.rate
+        next_tick = time.monotonic()
+        while self.running:
+            self.tick()
+            next_tick += period
+            now = time.monotonic()
+            if next_tick < now:
+                next_tick += np.ceil((now - next_tick) / period) * period
+            time.sleep(next_tick - now)
+
+    def stats(self):
+        return {'frames_sent': self.frames_sent,
+                'frames_dropped': self.frames_dropped,
+                'commands_coalesced': self.commands_coalesced,
+                'pending_bytes': len(self.pending),
+                'uncommanded_channels': int(np.count_nonzero(~self.commanded))}
@@ -0,0 +1,84 @@
+'''
+A pseudo terminal standing in for the robot's serial port, to run the links without hardware.
+The readers and writers open `port` like a real serial port, while the simulated device end
+writes telemetry and records whatever is written to it. Writes to the port never block: bytes the
+port can not take yet are queued and written by pump, once the reader drained some.
+'''
+
+import os
+import pty
+import tty
+import numpy as np
+from hardware.framing import telemetry_format, command_format
+from hardware.serial_port import read_available
+
+
+class SimulatedDevice(object):
+    def __init__(self, n_channels):
+        self.n_channels = n_channels
+        self.device_fd, self.port_fd = pty.openpty()
+        tty.setraw(self.device_fd)
+        tty.setraw(self.port_fd)
+        os.set_blocking(self.device_fd, False)
+        self.port = os.ttyname(self.port_fd)
+        self.telemetry_format = telemetry_format(n_channels)
+        self.seq = 0
+        self.received = b''
+        self.outgoing = b''
+
+    def send_telemetry(self, angles, encoders=None, timestamps=None):
+        '''
+        Write a batch of telemetry frames
+        :param angles: (n, n_channels) joint angles
+        :return: number of bytes still queued, see write
+        '''
+        angles = np.atleast_2d(angles)
+        n = len(angles)
+        seq = self.seq + np.arange(n)
+        self.seq += n
+        data = self.telemetry_format.encode(seq,
+                                            timestamp=timestamps if timestamps is not None else seq * 1000,
+                                            angles=angles,
+                                            encoders=encoders if encoders is not None else 0)
+        return self.write(data)
+
+    def write(self, data):
+        '''
+        Write raw bytes, e.g. to inject corrupt data. What does not fit into the port's buffer is
+        queued behind the bytes queued before
+        :return: number of bytes still queued, to be written by pump
+        '''
+        self.outgoing += bytes(data)
+        return self.pump()
+
+    def pump(self):
+        '''
+        Write queued bytes until the port's buffer is full, and receive what was written to the port
+        :return: number of bytes still queued
+        '''
+        while self.outgoing:
+            try:
+                n = os.write(self.device_fd, self.outgoing)
+            except BlockingIOError:
+                break
+            self.outgoing = self.outgoing[n:]
+        self.receive()
+        return len(self.outgoing)
+
+    def receive(self):
+        '''
+        :return: all bytes written to the port so far, also kept in `received`
+        '''
+        self.received += read_available(self.device_fd)
+        return self.received
+
+    def received_commands(self):
+        '''
+        :return: structured array of all valid command frames written to the port so far
+        '''
+        frames, _ = command_format(self.n_channels).decode(self.receive())
+        return frames
+
+    def close(self):
+        os.close(self.device_fd)
+        os.close(self.port_fd)
@@ -0,0 +1,141 @@
+'''
+Joint angle and encoder telemetry from the robot.
+
+The reader drains whatever the serial port has without blocking, decodes all complete frames of
+a read at once (see hardware.framing), and appends them to a preallocated ring buffer, so it keeps
+up with kHz rate telemetry without per frame Python work or allocations.
+'''
+
+import os
+import time
+import numpy as np
+from hardware.framing import telemetry_format
+from hardware.serial_port import open_serial_port, read_available
+
+
+class RingBuffer(object):
+    '''
+    Fixed capacity history of telemetry samples, oldest samples are overwritten first
+    '''
+    def __init__(self, capacity, n_channels):
+        self.capacity = capacity
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.uint32)
+        self.received = np.zeros(capacity)
+        self.angles = np.zeros((capacity, n_channels), dtype=np.float32)
+        self.encoders = np.zeros((capacity, n_channels), dtype=np.int32)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def extend(self, frames, received):
+        '''
+        :param frames: decoded telemetry frames
+        :param received: host time the frames were received at
+        '''
+        n = len(frames)
+        if n > self.capacity:
+            frames = frames[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+        slots = (self.count + np.arange(n)) % self.capacity
+        self.seq[slots] = frames['seq']
+        self.timestamps[slots] = frames['timestamp']
+        self.received[slots] = received
+        self.angles[slots] = frames['angles']
+        self.encoders[slots] = frames['encoders']
+        self.count += n
+
+    def last(self, n=None):
+        '''
+        :return: dict of arrays with the last n samples (all stored ones by default), oldest first
+        '''
+        n = len(self) if n is None else min(n, len(self))
+        slots = (self.count - n + np.arange(n)) % self.capacity
+        return {'seq': self.seq[slots],
+                'timestamps': self.timestamps[slots],
+                'received': self.received[slots],
+                'angles': self.angles[slots],
+                'encoders': self.encoders[slots]}
+
+
+class TelemetryReader(object):
+    def __init__(self, fd, joint_names, capacity=65536, max_read=65536):
+        '''
+        :param fd: non-blocking file descriptor of the port, see TelemetryReader.open
+        :param joint_names: joint path per telemetry channel
+        :param capacity: number of samples kept in the ring buffer
+        :param max_read: maximal number of bytes read per poll
+        '''
+        self.fd = fd
+        self.joint_names = list(joint_names)
+        self.frame_format = telemetry_format(len(self.joint_names))
+        self.buffer = RingBuffer(capacity, len(self.joint_names))
+        self.max_read = max_read
+        self.pending = b''
+        self.bytes_read = 0
+        self.bytes_dropped = 0
+        self.frames = 0
+        self.seq_gaps = 0
+        self.last_seq = None
+
+    @staticmethod
+    def open(path, joint_names, baudrate=None, **kwargs):
+        return TelemetryReader(open_serial_port(path, baudrate), joint_names, **kwargs)
+
+    def close(self):
+        os.close(self.fd)
+
+    def poll(self):
+        '''
+        Read and decode everything available without blocking
+        :return: number of new frames
+        '''
+        data = read_available(self.fd, self.max_read)
+        if not data:
+            return 0
+        self.bytes_read += len(data)
+        buffer = self.pending + data
+        frames, consumed = self.frame_format.decode(buffer)
+        self.pending = buffer[consumed:]
+        self.bytes_dropped += consumed - len(frames) * self.frame_format.size
+        if len(frames) == 0:
+            return 0
+
+        seq = frames['seq'].astype(np.int64)
+        if self.last_seq is not None:
+            seq = np.concatenate(([self.last_seq], seq))
+        self.seq_gaps += int(np.count_nonzero((np.diff(seq) & 0xffff) != 1))
+        self.last_seq = int(seq[-1])
+
+        self.buffer.extend(frames, time.monotonic())
+        self.frames += len(frames)
+        return len(frames)
+
+    def latest_pose(self):
+        '''
+        :return: dict of joint name to the last measured angle, or None before the first frame
+        '''
+        if len(self.buffer) == 0:
+            return None
+        angles = self.buffer.last(1)['angles'][0]
+        return {name: float(angle) for name, angle in zip(self.joint_names, angles)}
+
+    def apply_to_model(self, model):
+        '''
+        Set the joint angles of the model to the last measured pose
+        :return: False if nothing was received yet
+        '''
+        pose = self.latest_pose()
+        if pose is None:
+            return False
+        for name, angle in pose.items():
+            model.get(name).angle = angle
+        return True
+
+    def stats(self):
+        return {'frames': self.frames,
+                'bytes_read': self.bytes_read,
+                'bytes_dropped': self.bytes_dropped,
+                'seq_gaps': self.seq_gaps}
@@ -0,0 +1,155 @@
+'''
+Closed form inverse kinematics for the arm built by shapes.get_robot_arm.
+
+The arm is a kinematic chain of three shoulder joints rotating about a common origin, followed by
+an elbow joint, with fixed transforms (the upper and lower arm bones) in between. Rotations about
+the shoulder origin preserve the distance from it, so the elbow angle is determined by the
+distance between the shoulder and the target alone. The shoulder angles then only have to turn
+the arm towards the target, which is solved with the standard two intersecting axes subproblem,
+keeping the third shoulder joint (a twist about the arm) at its current angle whenever possible.
+'''
+
+import math
+import numpy as np
+from model.transformations import get_rotation_matrix_stack
+
+
+def _wrap_near(angle, reference):
+    '''
+    :return: the angle equivalent to angle (mod 2*pi) closest to reference
+    '''
+    return reference + (angle - reference + math.pi) % (2 * math.pi) - math.pi
+
+
+def _cross(u, v):
+    # np.cross has a large overhead for single 3 vectors
+    return np.array([u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]])
+
+
+def _rotation_angle(axis, u, v):
+    '''
+    :return: the angle of the rotation about axis which takes u as close as possible to v
+    '''
+    u = u - axis * np.dot(axis, u)
+    v = v - axis * np.dot(axis, v)
+    return math.atan2(np.dot(axis, _cross(u, v)), np.dot(u, v))
+
+
+def _sinusoid(f):
+    '''
+    Decompose f(theta) = c0 + c1 * cos(theta) + c2 * sin(theta), for a function f known to have
+    this form (a point rotated about an axis), by sampling it
+    '''
+    f0, f1, f2 = f(np.array([0.0, math.pi / 2, math.pi]))
+    c0 = (f0 + f2) / 2
+    return c0, f0 - c0, f1 - c0
+
+
+class AnalyticArmSolver(object):
+    def __init__(self, chain):
+        # copies, the chain's arrays may be the model's own, and the solver may be used on
+        # another thread while the model changes
+        self.columns = list(chain.columns)
+        self.axes = [a / np.linalg.norm(a) for a in chain.axes]
+        self.shoulder = np.array(chain.origins[0], dtype=float)
+        self.to_shoulder_frame = np.linalg.inv(chain.fixed[0])
+        elbow_fixed = np.array(chain.fixed[3], dtype=float)
+        lower_fixed = chain.fixed[4]
+        elbow_origin = np.array(chain.origins[3], dtype=float)
+        point = np.dot(lower_fixed[:3, :3], chain.point) + lower_fixed[:3, 3]
+
+        def hand(elbow_angles):
+            # hand position in the frame the third shoulder joint acts in
+            rotations = get_rotation_matrix_stack(self.axes[3], elbow_angles)
+            p = np.einsum('nij,j->ni', rotations, point - elbow_origin) + elbow_origin
+            return np.dot(p, elbow_fixed[:3, :3].T) + elbow_fixed[:3, 3] - self.shoulder
+
+        self.hand = hand
+        self.hand_terms = _sinusoid(hand)
+        self.shoulder_cross = _cross(self.axes[0], self.axes[1])
+        # offsets of the third shoulder joint tried when its current angle is infeasible
+        self.twist_offsets = np.concatenate(([0.0], np.linspace(-math.pi, math.pi, 65)[1:]))
+
+    @staticmethod
+    def match(chain):
+        '''
+        :return: a solver for the chain if it has the structure of the arm, None otherwise
+        '''
+        if len(chain.columns) != 4:
+            return None
+        for k in (1, 2):
+            if not np.allclose(chain.fixed[k], np.eye(4)):
+                return None
+            if not np.allclose(chain.origins[k], chain.origins[0]):
+                return None
+        a1 = chain.axes[0] / np.linalg.norm(chain.axes[0])
+        a2 = chain.axes[1] / np.linalg.norm(chain.axes[1])
+        if np.linalg.norm(np.cross(a1, a2)) < 1e-6:
+            return None
+        return AnalyticArmSolver(chain)
+
+    def solve(self, position, angles):
+        '''
+        :param position: target position, in model coordinates
+        :param angles: current angle vector (columns as in the chain), used to pick between the
+        mirror solutions, as the value of the redundant third shoulder joint, and for the
+        columns not on the chain
+        :return: new angle vector. Unreachable targets are approached as close as possible
+        '''
+        columns = self.columns
+        current = [angles[c] for c in columns]
+        w = np.dot(self.to_shoulder_frame[:3, :3], position) + self.to_shoulder_frame[:3, 3] - self.shoulder
+
+        # elbow: |hand(theta) - shoulder|^2 = |c0|^2 + |c1|^2 + 2 (c0.c1 cos(theta) + c0.c2 sin(theta))
+        c0, c1, c2 = self.hand_terms
+        p = np.dot(c0, c1)
+        q = np.dot(c0, c2)
+        k = (np.dot(w, w) - np.dot(c0, c0) - np.dot(c1, c1)) / 2
+        amplitude = math.hypot(p, q)
+        phase = math.atan2(q, p)
+        spread = math.acos(max(-1.0, min(1.0, k / amplitude))) if amplitude > 0 else 0.0
+        elbow = min([_wrap_near(phase + spread, current[3]), _wrap_near(phase - spread, current[3])],
+                    key=lambda a: abs(a - current[3]))
+
+        v = self.hand(np.array([elbow]))[0]
+        w_norm = np.linalg.norm(w)
+        if w_norm > 0:
+            # for unreachable targets, point the arm towards the target
+            w = w * (np.linalg.norm(v) / w_norm)
+
+        shoulder = self._solve_shoulder(v, w, current)
+        result = np.array(angles, dtype=float)
+        for c, a in zip(columns, shoulder + [elbow]):
+            result[c] = a
+        return result
+
+    def _solve_shoulder(self, v, w, current):
+        a1, a2, a3 = self.axes[:3]
+        rho = np.dot(a1, a2)
+        cross = self.shoulder_cross
+
+        # the third joint twists the arm about itself; keep its current angle if the first two
+        # joints can reach the target with it, otherwise the feasible angle closest to it
+        twists = current[2] + self.twist_offsets
+        v3 = np.einsum('nij,j->ni', get_rotation_matrix_stack(a3, twists), v)
+        a1w = np.dot(a1, w)
+        a2v = np.dot(v3, a2)
+        alpha = (rho * a2v - a1w) / (rho ** 2 - 1)
+        beta = (rho * a1w - a2v) / (rho ** 2 - 1)
+        gamma_sq = (np.dot(v, v) - alpha ** 2 - beta ** 2 - 2 * alpha * beta * rho) / np.dot(cross, cross)
+        feasible = np.nonzero(gamma_sq >= 0)[0]
+        if len(feasible) > 0:
+            i = feasible[np.argmin(np.abs(twists[feasible] - current[2]))]
+        else:
+            i = np.argmax(gamma_sq)
+        gamma = math.sqrt(max(gamma_sq[i], 0.0))
+
+        best = None
+        for sign in (1, -1):
+            c = alpha[i] * a1 + beta[i] * a2 + sign * gamma * cross
+            theta2 = _wrap_near(_rotation_angle(a2, v3[i], c), current[1])
+            theta1 = _wrap_near(_rotation_angle(a1, c, w), current[0])
+            deviation = abs(theta1 - current[0]) + abs(theta2 - current[1])
+            if best is None or deviation < best[0]:
+                best = (deviation, [theta1, theta2, float(twists[i])])
+        return best[1]
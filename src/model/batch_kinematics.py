@@ -0,0 +1,141 @@
+'''
+Forward kinematics of many instances of the same model at once.
+
+A template model (e.g. model.robot.build_model, made of shapes.get_robot_body and get_robot_arm)
+is reduced once to a tree of its free rotation joints: every joint keeps the fixed transform
+from its nearest free ancestor joint to its own coordinates, and every connection point is
+attached to its nearest free ancestor joint, with its coordinates in that joint's frame. Shapes
+and fixed elements take no part in the evaluation.
+
+The instances are a structure of arrays, one row of joint angles per instance. Evaluation walks
+the reduced tree once for all the rows together, so it costs a numpy operation per free joint
+and not a model per instance. Rows are evaluated in chunks, so memory grows with the number of
+instances only by the result, (instances, points, 3).
+'''
+
+import numpy as np
+from model.skeleton_model import Bone, RotationJoint
+from model.transformations import get_rotation_matrix_stack
+
+
+class BatchForwardKinematics(object):
+    def __init__(self, template, joint_names=None, points=None):
+        '''
+        :param template: model to take the structure, the geometry and the angles of the joints
+        which are not free from. Later changes to it are not seen
+        :param joint_names: ordered list of the free joint paths, one per column of the angle
+        arrays. All rotation joints of the template, sorted by path, by default
+        :param points: list of (element path, connection point name) to evaluate, all connection
+        points of the template by default (the end effectors among them)
+        '''
+        if joint_names is None:
+            joint_names = sorted(n for e, n in template.traverse_model() if isinstance(e, RotationJoint))
+        self.joint_names = list(joint_names)
+        columns = {n: i for i, n in enumerate(self.joint_names)}
+        wanted = set(points) if points is not None else None
+
+        # free joints, parents first: (parent joint index or -1, column, fixed 4x4 transform from
+        # the parent's frame to the joint's coordinates, axis, origin)
+        self.joints = []
+        # connection points: (name, joint index or -1, homogeneous coordinates in its frame)
+        found = []
+        pending = [(template, '', -1, np.eye(4))]
+        while pending:
+            element, path, anchor, fixed = pending.pop()
+            if isinstance(element, Bone):
+                for connection_point in element.connection_points:
+                    if wanted is None or (path, connection_point) in wanted:
+                        point = element.vectors['connection_point:' + connection_point].reshape((3,))
+                        found.append(((path, connection_point), anchor, np.dot(fixed, np.append(point, 1.0))))
+            free = isinstance(element, RotationJoint) and path in columns
+            if free:
+                # the joint's frame includes its own rotation, which is what it applies to children
+                self.joints.append((anchor, columns[path], fixed, element.vectors['axis'].reshape((3,)),
+                                    element.vectors['origin'].reshape((3,))))
+                anchor = len(self.joints) - 1
+                fixed = np.eye(4)
+            for child in element.child_elements.values():
+                child_path = path + '.' + child.name if path != '' else child.name
+                local = None if free else element._child_transform(child)
+                pending.append((child, child_path, anchor, fixed if local is None else np.dot(fixed, local)))
+        if wanted is not None and len(found) != len(wanted):
+            missing = wanted - set(name for name, _, _ in found)
+            raise ValueError('No connection point: ' + ', '.join('%s:%s' % m for m in sorted(missing)))
+
+        # point order follows the given points, or the template paths
+        if points is not None:
+            order = {p: i for i, p in enumerate(points)}
+            found.sort(key=lambda f: order[f[0]])
+        else:
+            found.sort(key=lambda f: f[0])
+        self.points = [name for name, _, _ in found]
+        self.point_names = ['%s:%s' % name for name in self.points]
+        self.point_anchors = np.array([anchor for _, anchor, _ in found], dtype=int)
+        self.point_coords = np.array([coords[:3] for _, _, coords in found]).reshape((-1, 3))
+
+        self.parents = [parent for parent, _, _, _, _ in self.joints]
+        self.columns = [column for _, column, _, _, _ in self.joints]
+        self.axes = np.array([axis for _, _, _, axis, _ in self.joints]).reshape((-1, 3))
+        # a joint rotates its children by R about its origin o, i.e. x -> R x + (o - R o)
+        self.fixed = np.array([fixed for _, _, fixed, _, _ in self.joints]).reshape((-1, 4, 4))
+        self.origins = np.array([origin for _, _, _, _, origin in self.joints]).reshape((-1, 3))
+        # the points in the frame of every joint, and the last joint which needs the frame
+        self.point_rows = [np.nonzero(self.point_anchors == j)[0] for j in range(len(self.joints))]
+        self.last_use = list(range(len(self.joints)))
+        for j, parent in enumerate(self.parents):
+            if parent >= 0:
+                self.last_use[parent] = max(self.last_use[parent], j)
+
+    def positions(self, angles, out=None, chunk_size=4096, dtype=float):
+        '''
+        :param angles: (..., len(joint_names)) joint angles, e.g. (instances, joints) or
+        (instances, poses, joints)
+        :param out: optional array of shape angles.shape[:-1] + (len(points), 3) to write into
+        :param chunk_size: number of angle vectors evaluated together
+        :param dtype: dtype of the result if out is not given, e.g. np.float32 to halve its size
+        :return: the positions of the connection points (ordered as point_names) in model
+        coordinates for every angle vector
+        '''
+        angles = np.asarray(angles)
+        if angles.shape[-1] != len(self.joint_names):
+            raise ValueError('expected %d joint angles per row' % len(self.joint_names))
+        shape = angles.shape[:-1] + (len(self.points), 3)
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        elif out.shape != shape:
+            raise ValueError('out should have shape ' + str(shape))
+        rows = angles.reshape((-1, len(self.joint_names)))
+        result = out.reshape((-1, len(self.points), 3))
+        for start in range(0, len(rows), chunk_size):
+            self._evaluate(np.asarray(rows[start:start + chunk_size], dtype=float),
+                           result[start:start + chunk_size])
+        if not np.shares_memory(result, out):
+            out[...] = result.reshape(shape)
+        return out
+
+    def _evaluate(self, angles, out):
+        # points fixed to the model root
+        rows = np.nonzero(self.point_anchors < 0)[0]
+        out[:, rows] = self.point_coords[rows]
+        if len(self.joints) == 0:
+            return
+
+        rotations = get_rotation_matrix_stack(self.axes, angles[:, self.columns])
+        translations = self.origins - np.einsum('nkij,kj->nki', rotations, self.origins)
+        # frames of the joints still needed, as rotation and translation
+        frames = {}
+        for j, parent in enumerate(self.parents):
+            # the parent's frame, then the fixed transform, then the joint's rotation
+            rotation = np.matmul(self.fixed[j, :3, :3], rotations[:, j])
+            translation = np.dot(translations[:, j], self.fixed[j, :3, :3].T) + self.fixed[j, :3, 3]
+            if parent >= 0:
+                parent_rotation, parent_translation = frames[parent]
+                translation = np.einsum('nij,nj->ni', parent_rotation, translation) + parent_translation
+                rotation = np.matmul(parent_rotation, rotation)
+                if self.last_use[parent] == j:
+                    del frames[parent]
+            rows = self.point_rows[j]
+            if len(rows) > 0:
+                out[:, rows] = np.einsum('nij,pj->npi', rotation, self.point_coords[rows]) + translation[:, None, :]
+            if self.last_use[j] > j:
+                frames[j] = (rotation, translation)
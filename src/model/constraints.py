@@ -0,0 +1,403 @@
+'''
+Search space constraints for the inverse kinematics solvers.
+
+Joint limits clip angle vectors into the (lower, upper) bounds of RotationJoint.limits.
+
+Self collision is checked in a broad phase on bounding volumes. Every Bone with shapes (a link)
+gets a box aligned with its own coordinates around the vertices of its shapes, a sphere around
+that box, and a box per shape inside it. Links are moving when a free joint is on their path
+from the root, and static otherwise. All pairs of links which can collide are tested for all the
+candidate angle vectors at once, first one link's sphere against the other link's box, then on
+the link boxes, and the pairs left are tested again on the shape boxes. Links joined only by
+joints (e.g. an upper arm and the body it is attached to) touch by construction and are never
+tested against each other.
+'''
+
+import copy
+import numpy as np
+from model.skeleton_model import Bone, RotationJoint, Shape, Target
+from model.kinematic_chain import KinematicChain
+
+
+def _box(vertices, tolerance):
+    '''
+    :return: center and half extents of the axis aligned box around the vertices, shrunk by
+    tolerance / 2 on every side
+    '''
+    lower = vertices.min(axis=0)
+    upper = vertices.max(axis=0)
+    return (lower + upper) / 2, np.maximum((upper - lower - tolerance) / 2, 0)
+
+
+# index combinations of the cross product axes in boxes_overlap
+_I = np.repeat(np.arange(3), 3)
+_J = np.tile(np.arange(3), 3)
+_I1, _I2, _J1, _J2 = (_I + 1) % 3, (_I + 2) % 3, (_J + 1) % 3, (_J + 2) % 3
+
+
+def boxes_overlap(transforms, centers_a, extents_a, centers_b, extents_b):
+    '''
+    Separating axis test between oriented boxes a and axis aligned boxes b, vectorized over
+    candidate transforms and all the pairs of boxes
+    :param transforms: (n, 4, 4) homogeneous transforms taking the coordinates of the a boxes to
+    the coordinates of the b boxes
+    :param centers_a: (p, 3) box centers, or (n, p, 3) for different boxes per transform.
+    extents_a: half extents of the same shape
+    :param centers_b: (q, 3) box centers, or (n, q, 3). extents_b: half extents of the same shape
+    :return: (n, p, q) boolean array, True where the boxes overlap
+    '''
+    r = transforms[:, None, None, :3, :3]
+    ar = np.abs(r) + 1e-9
+    # a's centers relative to b's centers, in b coordinates: (n, p, q, 3)
+    t = np.matmul(centers_a, transforms[:, :3, :3].transpose((0, 2, 1))) + transforms[:, None, :3, 3]
+    t = t[:, :, None, :] - centers_b[..., None, :, :]
+    ea = extents_a[..., :, None, :]
+    eb = extents_b[..., None, :, :]
+
+    # axes of b
+    separated = (np.abs(t) > eb + (ar * ea[..., None, :]).sum(axis=-1)).any(axis=-1)
+    # axes of a
+    ta = (t[..., :, None] * r).sum(axis=-2)
+    separated |= (np.abs(ta) > ea + (eb[..., :, None] * ar).sum(axis=-2)).any(axis=-1)
+    # cross products of an axis of b and an axis of a, all 9 at once
+    distance = np.abs(t[..., _I2] * r[..., _I1, _J] - t[..., _I1] * r[..., _I2, _J])
+    radius = eb[..., _I1] * ar[..., _I2, _J] + eb[..., _I2] * ar[..., _I1, _J] + \
+        ea[..., _J1] * ar[..., _I, _J2] + ea[..., _J2] * ar[..., _I, _J1]
+    separated |= (distance > radius).any(axis=-1)
+    return ~separated
+
+
+class JointLimits(object):
+    def __init__(self, joints):
+        '''
+        :param joints: the RotationJoint of every column of the angle arrays
+        '''
+        self.joints = list(joints)
+        self.refresh()
+
+    def refresh(self):
+        limits = [j.limits if j.limits is not None else (-np.inf, np.inf) for j in self.joints]
+        self.lower = np.array([l[0] for l in limits], dtype=float)
+        self.upper = np.array([l[1] for l in limits], dtype=float)
+        self.limited = bool(np.isfinite(self.lower).any() or np.isfinite(self.upper).any())
+        return self
+
+    def clip(self, angles):
+        if not self.limited:
+            return angles
+        return np.clip(angles, self.lower, self.upper)
+
+    def valid(self, angles):
+        angles = np.atleast_2d(angles)
+        return ((angles >= self.lower) & (angles <= self.upper)).all(axis=1)
+
+
+class SelfCollision(object):
+    def __init__(self, model, joint_names, tolerance=1.0):
+        '''
+        :param joint_names: ordered list of the free joint paths, one per column of the angle arrays
+        :param tolerance: penetration depth allowed between boxes, so links which only touch
+        (e.g. an arm resting against the body) do not count as colliding
+        '''
+        self.tolerance = tolerance
+        self.model = model
+        self.joint_names = list(joint_names)
+        self._build()
+
+    def _build(self):
+        '''
+        The links, their chains and the pairs to test, which only change with the model structure
+        '''
+        model = self.model
+        self.structure_version = model.structure_version
+        links = []
+        link_paths = set()
+        for element, path in sorted(model.traverse_model(), key=lambda x: x[1]):
+            if isinstance(element, Bone) and any(isinstance(e, Shape) for e in element.child_elements.values()):
+                links.append((element, path))
+                link_paths.add(path)
+        # (bone, path, chain to the bone, path of the nearest link above it or None)
+        self.links = []
+        for bone, path in links:
+            parent = path.rsplit('.', 1)[0] if '.' in path else None
+            while parent is not None and parent not in link_paths:
+                parent = parent.rsplit('.', 1)[0] if '.' in parent else None
+            self.links.append((bone, path, KinematicChain(model, path, None, self.joint_names), parent))
+
+        self.moving = [len(chain.columns) > 0 for _, _, chain, _ in self.links]
+        # longest chains first, see colliding
+        self.moving_links = sorted((a for a in range(len(self.links)) if self.moving[a]),
+                                   key=lambda a: -len(self.links[a][2].columns))
+        # (a, b) with a moving, every pair once
+        pairs = []
+        for a, (_, path_a, _, parent_a) in enumerate(self.links):
+            for b, (_, path_b, _, parent_b) in enumerate(self.links):
+                if not self.moving[a] or a == b or (self.moving[b] and b < a):
+                    continue
+                if parent_a == path_b or parent_b == path_a:
+                    continue
+                pairs.append((a, b))
+        self.pairs_a = np.array([a for a, _ in pairs], dtype=int)
+        self.pairs_b = np.array([b for _, b in pairs], dtype=int)
+
+        # the joints which are not free on the links' chains, their angles pose the static links
+        fixed_joints = {}
+        for _, _, chain, _ in self.links:
+            for element, _, column in chain.links:
+                if isinstance(element, RotationJoint) and column is None:
+                    fixed_joints[id(element)] = element
+        self.fixed_joints = list(fixed_joints.values())
+        # all vectors but the targets', they only change when the model is transformed
+        self.vertex_pool = model.get_vertex_pool()
+        rows = [np.arange(start, end) for element, _, start, end in self.vertex_pool.ranges
+                if not isinstance(element, Target)]
+        self.geometry_rows = np.concatenate(rows) if rows else np.zeros(0, dtype=int)
+        self.geometry = None
+        self.pose = None
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Update from the current state of the model: the transforms of the static links when the
+        angles of the joints which are not free changed, and the boxes only when the geometry
+        changed (e.g. the model was transformed)
+        '''
+        if self.structure_version != self.model.structure_version or \
+                self.vertex_pool is not self.model.get_vertex_pool():
+            return self._build()
+        geometry = self.vertex_pool.source[self.geometry_rows]
+        pose = [j.angle for j in self.fixed_joints]
+        geometry_changed = self.geometry is None or not np.array_equal(geometry, self.geometry)
+        if not geometry_changed and pose == self.pose:
+            return self
+        self.geometry = geometry
+        self.pose = pose
+        for _, _, chain, _ in self.links:
+            chain.refresh()
+        if geometry_changed:
+            self._refresh_boxes()
+        self.world = np.array([chain.fixed[0] for _, _, chain, _ in self.links]).reshape((-1, 4, 4))
+        self.world_inverse = np.linalg.inv(self.world)
+        self._prepare_pairs(geometry_changed)
+        return self
+
+    def _refresh_boxes(self):
+        '''
+        The boxes of the links and of their shapes, in the links' own coordinates
+        '''
+        link_centers = []
+        link_extents = []
+        self.shape_boxes = []
+        for bone, _, _, _ in self.links:
+            vertices = []
+            centers = []
+            extents = []
+            for shape in self._shapes(bone):
+                local = bone._child_transform(shape)
+                v = shape.vectors['vertices']
+                if local is not None:
+                    v = np.dot(v, local[:3, :3].T) + local[:3, 3]
+                vertices.append(v)
+                center, extent = _box(v, self.tolerance)
+                centers.append(center)
+                extents.append(extent)
+            center, extent = _box(np.concatenate(vertices), self.tolerance)
+            link_centers.append(center)
+            link_extents.append(extent)
+            self.shape_boxes.append((np.array(centers), np.array(extents)))
+        self.link_centers = np.array(link_centers).reshape((-1, 3))
+        self.link_extents = np.array(link_extents).reshape((-1, 3))
+        self.link_radii = np.linalg.norm(self.link_extents, axis=1)
+
+    def _prepare_pairs(self, geometry_changed=True):
+        '''
+        Everything colliding needs per pair of links which does not depend on the angles
+        :param geometry_changed: False if only the transforms of the static links changed
+        '''
+        # the inverse world transforms of the static b links, the moving ones are set per call
+        self.pair_inverse = self.world_inverse[self.pairs_b]
+        self._prepare_factors()
+        if not geometry_changed:
+            return
+        moving_index = {a: i for i, a in enumerate(self.moving_links)}
+        self.pair_moving_a = np.array([moving_index[a] for a in self.pairs_a], dtype=int)
+        self.pair_moving_b = np.array([moving_index.get(b, -1) for b in self.pairs_b], dtype=int)
+        self.moving_b = self.pair_moving_b >= 0
+        self.pair_centers_a = self.link_centers[self.pairs_a]
+        self.pair_centers_b = self.link_centers[self.pairs_b]
+        self.pair_extents_b = self.link_extents[self.pairs_b]
+        self.pair_radii_squared = self.link_radii[self.pairs_a] ** 2
+        # single shapes, where the shape boxes are the link boxes
+        self.pair_single = np.array([len(self.shape_boxes[a][0]) == 1 and len(self.shape_boxes[b][0]) == 1
+                                     for a, b in zip(self.pairs_a, self.pairs_b)], dtype=bool)
+
+    def _prepare_factors(self):
+        '''
+        A moving link's transform is the product of one factor per free joint on its chain: the
+        joint's transform times the fixed transform following it, the first one also preceded by
+        the fixed transform leading to it. With Rodrigues, a joint's transform is
+        I + sin(angle) A + (1 - cos(angle)) B, with K the cross product matrix of its axis and o its
+        origin, A = [K, -K o] and B = [K K, -K K o], so a factor is F + sin(angle) A F +
+        (1 - cos(angle)) B F, with the constant parts multiplied out here
+        '''
+        constant = []
+        sin = []
+        cos = []
+        columns = []
+        self.moving_link_factors = []
+        for a in self.moving_links:
+            chain = self.links[a][2]
+            self.moving_link_factors.append((len(columns), len(columns) + len(chain.columns)))
+            for k, (column, axis, origin) in enumerate(zip(chain.columns, chain.axes, chain.origins)):
+                axis = np.asarray(axis, dtype=float).flatten()
+                axis = axis / np.linalg.norm(axis)
+                origin = np.asarray(origin, dtype=float).flatten()
+                cross = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+                square = np.dot(cross, cross)
+                joint_sin = np.zeros((4, 4))
+                joint_sin[:3, :3] = cross
+                joint_sin[:3, 3] = -np.dot(cross, origin)
+                joint_cos = np.zeros((4, 4))
+                joint_cos[:3, :3] = square
+                joint_cos[:3, 3] = -np.dot(square, origin)
+                before = chain.fixed[0] if k == 0 else np.eye(4)
+                after = chain.fixed[k + 1]
+                constant.append(np.dot(before, after))
+                sin.append(np.dot(np.dot(before, joint_sin), after))
+                cos.append(np.dot(np.dot(before, joint_cos), after))
+                columns.append(column)
+        self.factor_columns = np.array(columns, dtype=int)
+        self.factor_constant = np.array(constant).reshape((-1, 4, 4))
+        self.factor_sin = np.array(sin).reshape((-1, 4, 4))
+        self.factor_cos = np.array(cos).reshape((-1, 4, 4))
+
+    @staticmethod
+    def _shapes(bone):
+        pending = [e for e in bone.child_elements.values() if isinstance(e, Shape)]
+        while pending:
+            shape = pending.pop()
+            yield shape
+            pending.extend(shape.child_elements.values())
+
+    def snapshot(self):
+        '''
+        :return: a copy which stays valid while the model changes, see KinematicChain.snapshot
+        '''
+        collision = copy.copy(self)
+        collision.links = [(bone, path, chain.snapshot(), parent) for bone, path, chain, parent in self.links]
+        return collision
+
+    def colliding(self, angles):
+        '''
+        Tests the bounding sphere of a's link box against b's link box first, then the link boxes,
+        then the shape boxes, each stage only for the pairs of links and candidates left by the
+        previous one
+        :param angles: (n, len(joint_names)) array of joint angles, or a single angle vector
+        :return: (n,) boolean array, True for the angle vectors where links collide
+        '''
+        angles = np.atleast_2d(angles)
+        n = angles.shape[0]
+        colliding = np.zeros(n, dtype=bool)
+        if len(self.pairs_a) == 0:
+            return colliding
+        # all the factors of the moving links' transforms at once, see _prepare_factors
+        factor_angles = angles[:, self.factor_columns, None, None]
+        factors = self.factor_constant + np.sin(factor_angles) * self.factor_sin + \
+            (1 - np.cos(factor_angles)) * self.factor_cos
+        moving = np.empty((n, len(self.moving_links), 4, 4))
+        for i, (start, end) in enumerate(self.moving_link_factors):
+            world = factors[:, start]
+            for k in range(start + 1, end):
+                world = np.matmul(world, factors[:, k])
+            moving[:, i] = world
+
+        # (candidate, pair): transforms from a's coordinates to b's coordinates
+        inverse = self.pair_inverse
+        if self.moving_b.any():
+            inverse = np.tile(inverse, (n, 1, 1, 1))
+            world_b = moving[:, self.pair_moving_b[self.moving_b]]
+            # rigid transforms, the inverse rotation is the transpose
+            inverse_b = np.zeros(world_b.shape)
+            inverse_b[..., :3, :3] = world_b[..., :3, :3].swapaxes(-1, -2)
+            inverse_b[..., :3, 3] = -np.einsum('npij,npj->npi', inverse_b[..., :3, :3], world_b[..., :3, 3])
+            inverse_b[..., 3, 3] = 1
+            inverse[:, self.moving_b] = inverse_b
+        relative = np.matmul(inverse, moving[:, self.pair_moving_a])
+
+        centers = np.einsum('npij,pj->npi', relative[..., :3, :3], self.pair_centers_a) + relative[..., :3, 3]
+        centers -= self.pair_centers_b
+        # distance of a's center to b's box, which b's coordinates are aligned with
+        outside = np.maximum(np.abs(centers) - self.pair_extents_b, 0)
+        close = (outside * outside).sum(axis=-1) <= self.pair_radii_squared
+        if not close.any():
+            return colliding
+        candidates, pairs = np.nonzero(close)
+        relative = relative[candidates, pairs]
+        a = self.pairs_a[pairs]
+        b = self.pairs_b[pairs]
+
+        overlap = boxes_overlap(relative, self.link_centers[a, None], self.link_extents[a, None],
+                                self.link_centers[b, None], self.link_extents[b, None])[:, 0, 0]
+        single = self.pair_single[pairs]
+        colliding[candidates[overlap & single]] = True
+        rest = overlap & ~single
+        if not rest.any():
+            return colliding
+        relative, candidates, pairs = relative[rest], candidates[rest], pairs[rest]
+        for pair in np.unique(pairs).tolist():
+            rows = pairs == pair
+            overlap = boxes_overlap(relative[rows], *self.shape_boxes[self.pairs_a[pair]],
+                                    *self.shape_boxes[self.pairs_b[pair]])
+            colliding[candidates[rows][overlap.any(axis=(1, 2))]] = True
+        return colliding
+
+
+class Constraints(object):
+    '''
+    The constraints the solvers check candidate angle vectors against: the joint limits, and
+    optionally self collision
+    '''
+    def __init__(self, model, joint_names, self_collision=False, tolerance=1.0):
+        '''
+        :param joint_names: ordered list of the free joint paths, one per column of the angle arrays
+        :param self_collision: reject angle vectors where links collide, see SelfCollision
+        '''
+        self.joint_names = list(joint_names)
+        self.limits = JointLimits([model.get(n) for n in self.joint_names])
+        self.self_collision = SelfCollision(model, self.joint_names, tolerance) if self_collision else None
+
+    def refresh(self):
+        self.limits.refresh()
+        if self.self_collision is not None:
+            self.self_collision.refresh()
+        return self
+
+    def snapshot(self):
+        constraints = copy.copy(self)
+        constraints.limits = copy.copy(self.limits)
+        if self.self_collision is not None:
+            constraints.self_collision = self.self_collision.snapshot()
+        return constraints
+
+    def key(self):
+        '''
+        :return: hashable description of the constraints, e.g. to keep cached solutions apart
+        '''
+        return (tuple(self.limits.lower.tolist()), tuple(self.limits.upper.tolist()),
+                self.self_collision.tolerance if self.self_collision is not None else None)
+
+    def clip(self, angles):
+        '''
+        :return: the angles clipped into the joint limits
+        '''
+        return self.limits.clip(angles)
+
+    def valid(self, angles):
+        '''
+        :param angles: (n, len(joint_names)) array of joint angles, or a single angle vector
+        :return: (n,) boolean array, True for the angle vectors which satisfy all constraints
+        '''
+        valid = self.limits.valid(angles)
+        if self.self_collision is not None and valid.any():
+            valid[valid] = ~self.self_collision.colliding(np.atleast_2d(angles)[valid])
+        return valid
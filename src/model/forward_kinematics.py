@@ -0,0 +1,85 @@
+'''
+Compiled forward kinematics.
+
+The default Model.calc_coords lets every element act on the mapped vectors of its entire
+subtree, so a vector N levels deep is transformed N times. KinematicTree flattens the element
+tree once into a topologically ordered list (every element comes after its parent), composes a
+single homogeneous world transform per element and maps every vector exactly once.
+World transforms are cached between calls, so only the subtrees marked dirty since (changed
+joint angles, moved targets, transformed vectors) are recalculated. The vectors of all elements
+live in the model's VertexPool, so the rows of the stale elements are mapped in one operation.
+'''
+
+import numpy as np
+
+
+class KinematicTree(object):
+    def __init__(self, model, vertex_pool):
+        '''
+        :param vertex_pool: VertexPool holding the vectors of all the elements of the model
+        '''
+        self.model = model
+        self.vertex_pool = vertex_pool
+        self.elements = []
+        self.parents = []
+        self._flatten(model, -1)
+        # index of the element owning each row of the vertex pool
+        self.rows = vertex_pool.element_rows({e: i for i, e in enumerate(self.elements)})
+        # cached world transforms, see calc_coords
+        self.world = None
+
+    def _flatten(self, element, parent):
+        index = len(self.elements)
+        self.elements.append(element)
+        self.parents.append(parent)
+        for e in element.child_elements.values():
+            self._flatten(e, index)
+
+    def world_transforms(self):
+        '''
+        :return: (n_elements, 4, 4) array, the transform mapping each element's own vectors
+        to model coordinates
+        '''
+        world = np.empty((len(self.elements), 4, 4))
+        for i, (element, parent) in enumerate(zip(self.elements, self.parents)):
+            world[i] = self._world_transform(world, element, parent)
+        return world
+
+    def _world_transform(self, world, element, parent):
+        if parent < 0:
+            return np.eye(4)
+        local = self.elements[parent]._child_transform(element)
+        return world[parent] if local is None else np.dot(world[parent], local)
+
+    def calc_coords(self):
+        '''
+        Only recalculates the subtrees marked dirty (see Element.mark_dirty) and reuses the
+        cached world transforms for the rest. Elements whose mapped vectors were transformed
+        since are only remapped with their cached world transform
+        '''
+        if self.world is None:
+            self.world = np.empty((len(self.elements), 4, 4))
+            for element in self.elements:
+                element.dirty = True
+        stale = [False] * len(self.elements)
+        remap = np.zeros(len(self.elements), dtype=bool)
+        for i, (element, parent) in enumerate(zip(self.elements, self.parents)):
+            if element.dirty or (parent >= 0 and stale[parent]):
+                stale[i] = True
+                self.world[i] = self._world_transform(self.world, element, parent)
+            remap[i] = stale[i] or element.mapped_dirty
+            element.dirty = False
+            element.mapped_dirty = False
+
+        pool = self.vertex_pool
+        if remap.all():
+            self._map(self.rows, pool.source, pool.mapped)
+        elif remap.any():
+            rows = remap[self.rows]
+            pool.mapped[rows] = self._map(self.rows[rows], pool.source[rows])
+
+    def _map(self, owners, vectors, out=None):
+        world = self.world[owners]
+        out = np.einsum('nij,nj->ni', world[:, :3, :3], vectors, out=out)
+        out += world[:, :3, 3]
+        return out
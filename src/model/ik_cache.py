@@ -0,0 +1,124 @@
+'''
+Cache of inverse kinematics solutions.
+
+Solutions are keyed by the target position, quantized to a grid, together with the joint set,
+the source connection point and the constraints they were solved for, and evicted least recently
+used first. A cache may be shared between solvers running on different threads.
+On a miss, the last solution for the same joints and source can warm start the search if the
+target only moved a small distance since it was solved. Solutions can be checked against the
+current state of the model on the way out, e.g. for collisions with links which moved since they
+were solved, and the ones failing the check count as misses.
+'''
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class SolutionCache(object):
+    def __init__(self, quantization=1.0, max_size=1024, warm_start_distance=20.0, max_residual=2.0):
+        '''
+        :param quantization: grid size for target positions, targets in the same grid cell
+        share a solution
+        :param max_size: maximal number of cached solutions
+        :param warm_start_distance: how far a target may be from the last solved one for the
+        last solution to be used as a starting point. None to disable warm starts
+        :param max_residual: results of searches which stopped before reaching the target (e.g.
+        on a deadline or max_iterations) are only stored if they are at most this far from it
+        '''
+        self.quantization = quantization
+        self.max_size = max_size
+        self.warm_start_distance = warm_start_distance
+        self.max_residual = max_residual
+        self.lock = threading.Lock()
+        self.solutions = OrderedDict()
+        self.last_solutions = {}
+        self.hits = 0
+        self.misses = 0
+        self.warm_starts = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    def _key(self, position, joint_names, source_element, source_connection_point, constraints):
+        cell = tuple(int(x) for x in np.round(np.asarray(position).flatten() / self.quantization))
+        return cell, frozenset(joint_names), source_element, source_connection_point, constraints
+
+    def lookup(self, position, joint_names, source_element, source_connection_point, constraints=None,
+               valid=None):
+        '''
+        :param constraints: hashable description of the constraints the solution has to satisfy
+        (see Constraints.key), solutions for other constraints are not returned
+        :param valid: optional check of the cached angle vector against what the key does not
+        cover, e.g. the pose of the links it must not collide with. Returns False to reject it
+        :return: the cached angle vector, or None
+        '''
+        key = self._key(position, joint_names, source_element, source_connection_point, constraints)
+        with self.lock:
+            angles = self.solutions.get(key)
+            angles = np.copy(angles) if angles is not None else None
+        # checked outside the lock, a collision check takes a while
+        rejected = angles is not None and valid is not None and not valid(angles)
+        with self.lock:
+            if angles is None or rejected:
+                self.misses += 1
+                self.rejected += rejected
+                return None
+            self.hits += 1
+            if key in self.solutions:
+                self.solutions.move_to_end(key)
+            return angles
+
+    def warm_start(self, position, joint_names, source_element, source_connection_point, constraints=None,
+                   valid=None):
+        '''
+        :param valid: optional check of the angle vector, see lookup
+        :return: the last solution for these joints, source and constraints, if it was solved for
+        a nearby target, otherwise None
+        '''
+        if self.warm_start_distance is None:
+            return None
+        with self.lock:
+            last = self.last_solutions.get((frozenset(joint_names), source_element, source_connection_point,
+                                            constraints))
+        if last is None:
+            return None
+        last_position, angles = last
+        if np.linalg.norm(np.asarray(position).flatten() - last_position, ord=2) > self.warm_start_distance:
+            return None
+        if valid is not None and not valid(angles):
+            with self.lock:
+                self.rejected += 1
+            return None
+        with self.lock:
+            self.warm_starts += 1
+        return np.copy(angles)
+
+    def store(self, position, joint_names, source_element, source_connection_point, angles, constraints=None):
+        angles = np.array(angles, dtype=float)
+        key = self._key(position, joint_names, source_element, source_connection_point, constraints)
+        with self.lock:
+            self.solutions[key] = angles
+            self.solutions.move_to_end(key)
+            while len(self.solutions) > self.max_size:
+                self.solutions.popitem(last=False)
+                self.evictions += 1
+            self.last_solutions[key[1:]] = (np.array(position, dtype=float).flatten(), angles)
+
+    def clear(self):
+        with self.lock:
+            self.solutions.clear()
+            self.last_solutions.clear()
+
+    def stats(self):
+        with self.lock:
+            return self._stats()
+
+    def _stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'warm_starts': self.warm_starts,
+                'evictions': self.evictions,
+                'rejected': self.rejected,
+                'size': len(self.solutions)}
@@ -0,0 +1,76 @@
+'''
+Instrumentation of inverse kinematics searches.
+'''
+
+import time
+from contextlib import contextmanager
+
+
+class SearchStats(object):
+    '''
+    What happened during a single search: wall time per phase, number of h evaluations (end
+    effector positions computed), the best g (deviation cost) and h (distance to the target)
+    scores per iteration, why the search stopped and the final distance to the target.
+
+    Stop reasons: 'max_iterations', 'early_stop' (beam search reached early_stop),
+    'converged' (dls reached its tolerance), 'constrained' (dls could not step without violating
+    the constraints), 'deadline' (the time budget was spent first), 'closed_form' (analytic
+    solver), 'cache_hit', 'unreachable' (rejected by the workspace index)
+    '''
+    def __init__(self, solver):
+        self.solver = solver
+        self.phase_times = {}
+        self.evaluations = 0
+        self.best_g = []
+        self.best_h = []
+        self.stop_reason = None
+        self.residual = None
+        self.total_time = None
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Accumulate the wall time spent in the with block under the given phase name
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_times[name] = self.phase_times.get(name, 0.0) + time.perf_counter() - start
+
+    def deadline_passed(self, deadline):
+        '''
+        :param deadline: time budget in milliseconds since the search started, or None
+        '''
+        return deadline is not None and (time.perf_counter() - self.start_time) * 1000 >= deadline
+
+    def add_iteration(self, best_g, best_h):
+        self.best_g.append(float(best_g))
+        self.best_h.append(float(best_h))
+
+    @property
+    def iterations(self):
+        return len(self.best_h)
+
+    def finish(self, stop_reason, residual=None):
+        self.stop_reason = stop_reason
+        self.residual = float(residual) if residual is not None else None
+        self.total_time = time.perf_counter() - self.start_time
+
+    def as_dict(self):
+        return {'solver': self.solver,
+                'stop_reason': self.stop_reason,
+                'residual': self.residual,
+                'iterations': self.iterations,
+                'evaluations': self.evaluations,
+                'total_time': self.total_time,
+                'phase_times': dict(self.phase_times),
+                'best_g': list(self.best_g),
+                'best_h': list(self.best_h)}
+
+    def __str__(self):
+        residual = '%.3f' % self.residual if self.residual is not None else '-'
+        total_time = self.total_time * 1000 if self.total_time is not None else float('nan')
+        return 'IK %s: %s after %d iterations, %d evaluations, residual %s, %.3f ms' % \
+               (self.solver, self.stop_reason, self.iterations, self.evaluations, residual, total_time)
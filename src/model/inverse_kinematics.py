@@ -4,14 +4,18 @@ position in space.
 
 The search is really simple and primitive... it is done using simple beam search of the model parameters.
 It is probably only good for simple models with few parameters.
-TODO: this should return the entire movement path, not only the target parameters
-TODO: should be able to consider arbitrary search space constraints
+InverseKinematics.trajectory gives the entire movement path to the solution, see model.trajectory
+Joint limits, and optionally self collision, constrain the search, see model.constraints
 '''
 
 import copy
-import random
 import numpy as np
 from model.skeleton_model import RotationJoint
+from model.kinematic_chain import KinematicChain
+from model.constraints import Constraints
+from model.analytic_ik import AnalyticArmSolver
+from model.trajectory import Trajectory
+from model.ik_stats import SearchStats
 
 
 class RotationJointAngleParam(object):
@@ -19,24 +23,35 @@ class RotationJointAngleParam(object):
         self.joint_name = joint_name
         self.base_angle = base_angle
         self.angle = angle if angle is not None else base_angle
+        # resolved joint element, see bind
+        self.model = None
+        self.joint = None
 
     def copy(self):
-        return RotationJointAngleParam(self.joint_name, self.base_angle, self.angle)
+        param = RotationJointAngleParam(self.joint_name, self.base_angle, self.angle)
+        param.model = self.model
+        param.joint = self.joint
+        return param
 
-    def apply_random_step(self, step):
-        r = random.randrange(3)
-        if r == 1:
-            self.angle += step
-        elif r == 2:
-            self.angle -= step
+    def bind(self, model, joint=None):
+        '''
+        Resolve the joint in the model once, so applying to the same model again needs no path
+        lookup. The handle is only valid as long as the joint stays in the model
+        '''
+        self.model = model
+        self.joint = joint if joint is not None else model.get(self.joint_name)
+        return self
+
+    def _get_joint(self, model):
+        if model is not self.model:
+            self.bind(model)
+        return self.joint
 
     def apply_to_model(self, model):
-        joint = model.get(self.joint_name)
-        joint.angle = self.angle
+        self._get_joint(model).angle = self.angle
 
     def reset_model(self, model):
-        joint = model.get(self.joint_name)
-        joint.angle = self.base_angle
+        self._get_joint(model).angle = self.base_angle
 
     def cost(self):
         return abs(self.angle - self.base_angle)
@@ -49,22 +64,137 @@ def collect_parameters(model, joint_names=None):
         # them move randomly
         for element, name in model.traverse_model():
             if isinstance(element, RotationJoint):
-                params.add(RotationJointAngleParam(name, element.angle))
+                params.add(RotationJointAngleParam(name, element.angle).bind(model, element))
     else:
         for name in joint_names:
             element = model.get(name)
             if isinstance(element, RotationJoint):
-                params.add(RotationJointAngleParam(name, element.angle))
+                params.add(RotationJointAngleParam(name, element.angle).bind(model, element))
     return params
 
 
+class SolverView(object):
+    '''
+    What the solvers need from the model: the parameters (ordered by joint name) bound to the
+    joints, the kinematic chain to the source connection point, the target position and the
+    constraints.
+    Built once per solver and refreshed from the model's current state before every search,
+    without copying the model. Rebuilt only when the model structure changes
+    '''
+    def __init__(self, model, source_element, source_connection_point, target_name, joint_names,
+                 self_collision=False):
+        self.model = model
+        self.structure_version = model.structure_version
+        self.target = model.get(target_name)
+        self.params = sorted(collect_parameters(model, joint_names), key=lambda p: p.joint_name)
+        self.chain = KinematicChain(model, source_element, source_connection_point,
+                                    [p.joint_name for p in self.params])
+        self.constraints = Constraints(model, [p.joint_name for p in self.params], self_collision)
+        self.target_position = None
+        # (chain geometry, AnalyticArmSolver or False), matched again only when the chain's
+        # geometry changes, see get_analytic_solver
+        self.analytic_match = None
+        # the view a snapshot was taken from, None for the view itself
+        self.source = None
+        self.refresh()
+
+    def is_current(self):
+        return self.structure_version == self.model.structure_version
+
+    def refresh(self):
+        for p in self.params:
+            p.base_angle = p.angle = p.joint.angle
+        self.target_position = np.array(self.target.vectors['position'], dtype=float).reshape((3,))
+        self.chain.refresh()
+        self.constraints.refresh()
+        return self
+
+    def get_analytic_solver(self):
+        '''
+        :return: AnalyticArmSolver for the chain, or None if it is not shaped like an arm
+        '''
+        geometry = self.chain.geometry()
+        match = self.analytic_match
+        if match is None or not np.array_equal(match[0], geometry):
+            match = (geometry, AnalyticArmSolver.match(self.chain) or False)
+            self.analytic_match = match
+            if self.source is not None:
+                # matched on a snapshot (e.g. on a background thread), the view it was taken from
+                # and its later snapshots reuse the match while the geometry stays the same
+                self.source.analytic_match = match
+        return match[1] or None
+
+    def snapshot(self):
+        '''
+        :return: a frozen copy, which stays valid (e.g. for a search on another thread) while
+        the model changes. It should not be refreshed
+        '''
+        view = copy.copy(self)
+        view.source = self
+        view.params = [p.copy() for p in self.params]
+        view.chain = self.chain.snapshot()
+        view.constraints = self.constraints.snapshot()
+        view.target_position = np.copy(self.target_position)
+        return view
+
+
 class InverseKinematics(object):
-    def __init__(self, model, source_element, source_connection_point, target_name, joint_names=None):
+    SOLVERS = ('beam', 'dls', 'analytic')
+    # times a dls step violating the constraints is halved before giving up
+    MAX_STEP_HALVINGS = 4
+    # stop reasons of searches which reached what they aimed for, see SearchStats. Only these
+    # results, or others close enough to the target, are cached
+    SOLVED_STOP_REASONS = ('converged', 'early_stop', 'closed_form')
+
+    def __init__(self, model, source_element, source_connection_point, target_name, joint_names=None,
+                 seed=None, solver='beam', cache=None, workspace=None, stats_callback=None,
+                 self_collision=False):
+        '''
+        :param solver: default solver used by search: 'beam' for beam search, 'dls' for
+        jacobian based damped least squares, 'analytic' for the closed form solution of
+        chains shaped like shapes.get_robot_arm (falls back to beam search for other chains)
+        :param cache: optional SolutionCache (see model.ik_cache), may be shared between solvers
+        :param workspace: optional WorkspaceIndex (see model.workspace) built for the same joints,
+        used to reject unreachable targets and to seed the iterative solvers
+        :param stats_callback: called with the SearchStats of every search (see model.ik_stats).
+        The stats of the last search are also kept in last_stats
+        :param self_collision: reject solutions where links of the model collide, see
+        model.constraints. Joint limits (RotationJoint.limits) are always respected
+        '''
+        if solver not in self.SOLVERS:
+            raise ValueError('unknown solver: ' + str(solver))
+        if workspace is not None and set(workspace.joint_names) != set(joint_names):
+            raise ValueError('workspace index was built for different joints')
         self.source_model = model
         self.source_element = source_element
         self.source_connection_point = source_connection_point
         self.target_name = target_name
         self.joint_names = joint_names
+        self.solver = solver
+        self.cache = cache
+        self.workspace = workspace
+        self.stats_callback = stats_callback
+        self.self_collision = self_collision
+        self.last_stats = None
+        self.view = None
+        self.random = np.random.default_rng(seed)
+
+    def solver_view(self):
+        '''
+        :return: the SolverView of the source model, refreshed from its current state
+        '''
+        if self.view is None or not self.view.is_current():
+            self.view = SolverView(self.source_model, self.source_element, self.source_connection_point,
+                                   self.target_name, self.joint_names, self.self_collision)
+        else:
+            self.view.refresh()
+        return self.view
+
+    def snapshot_view(self):
+        '''
+        :return: frozen SolverView of the current state of the source model, see search
+        '''
+        return self.solver_view().snapshot()
 
     def search(self,
                beam_size=10,
@@ -72,58 +202,346 @@ class InverseKinematics(object):
                max_iterations=50,
                step=0.1,
                early_stop=2.0,
-               apply=False):
+               apply=False,
+               solver=None,
+               view=None,
+               deadline=None):
+        '''
+        Runs the selected solver (self.solver by default). Parameters not used by the
+        selected solver are ignored.
+        Solves for the current state of the source model, or for the given view, e.g. a
+        snapshot_view taken earlier on another thread.
+        With a cache, cached solutions (for the same constraints) are returned without
+        searching, and misses are warm started from the last solution when the target only
+        moved a little. Both have to satisfy the constraints in the current state of the model,
+        e.g. not collide with links which moved since they were solved. Results of searches which
+        stopped before reaching the target (e.g. on the deadline) are only cached if they are
+        within the cache's max_residual.
+        With a workspace index, the iterative solvers start from the nearest sampled
+        configurations unless warm started
+        :return: the solution as a set of RotationJointAngleParam, or None if the workspace
+        index shows the target is unreachable
+        :param deadline: time budget in milliseconds, counted from the start of the search, so
+        including the setup (refreshing the view, checking cached solutions). The iterative
+        solvers then return the best solution found so far once it is spent, with stop reason
+        'deadline' in the stats
+        '''
+        solver = solver if solver is not None else self.solver
+        if solver not in self.SOLVERS:
+            raise ValueError('unknown solver: ' + str(solver))
+        stats = SearchStats(solver)
+        with stats.phase('setup'):
+            view = view if view is not None else self.solver_view()
+        position = view.target_position
+        if self.workspace is not None and not self.workspace.is_reachable(position):
+            self._finish(stats, 'unreachable')
+            return None
+        start = None
+        if self.cache is not None:
+            key = (position, self.joint_names, self.source_element, self.source_connection_point)
+            constraints = view.constraints.key()
+            valid = lambda a: bool(view.constraints.valid(a)[0])
+            # checking cached solutions takes a while with self collision, once the deadline
+            # passed they are skipped and the solver stops right away
+            if not stats.deadline_passed(deadline):
+                angles = self.cache.lookup(*key, constraints=constraints, valid=valid)
+                if angles is not None:
+                    self._finish(stats, 'cache_hit')
+                    return self._result(view.params, angles, apply)
+            if not stats.deadline_passed(deadline):
+                start = self.cache.warm_start(*key, constraints=constraints, valid=valid)
+        if start is None and self.workspace is not None and solver != 'analytic':
+            start = self._workspace_seeds(position, beam_size)
+
+        result = None
+        if solver == 'analytic':
+            # None for chains not shaped like an arm, which fall back to beam search
+            result = self.analytic_search(apply=apply, start=start, stats=stats, view=view)
+        elif solver == 'dls':
+            result = self.dls_search(max_iterations=max_iterations, apply=apply, start=start, stats=stats,
+                                     view=view, deadline=deadline)
+        if result is None:
+            stats.solver = 'beam'
+            result = self.beam_search(beam_size=beam_size,
+                                      n_next_steps=n_next_steps,
+                                      max_iterations=max_iterations,
+                                      step=step,
+                                      early_stop=early_stop,
+                                      apply=apply,
+                                      start=start,
+                                      stats=stats,
+                                      view=view,
+                                      deadline=deadline)
+
+        if self.cache is not None and (stats.stop_reason in self.SOLVED_STOP_REASONS or
+                                       stats.residual is not None and stats.residual <= self.cache.max_residual):
+            self.cache.store(*key, angles=[p.angle for p in sorted(result, key=lambda p: p.joint_name)],
+                             constraints=constraints)
+        return result
+
+    def trajectory(self, max_velocity, dt=0.01, **search_kwargs):
+        '''
+        Solve for the current target and plan the movement from the current pose to the solution
+        :param max_velocity: joint velocity limit in radians per second, for all joints or
+        per joint (ordered by joint name)
+        :param dt: time between waypoints, in seconds
+        :param search_kwargs: passed on to search (apply is not allowed)
+        :return: Trajectory over the joints ordered by joint name, or None if the target is
+        unreachable
+        '''
+        result = self.search(apply=False, **search_kwargs)
+        if result is None:
+            return None
+        params = sorted(result, key=lambda p: p.joint_name)
+        return Trajectory([p.joint_name for p in params],
+                          [p.base_angle for p in params],
+                          [p.angle for p in params],
+                          max_velocity,
+                          dt)
+
+    def beam_search(self,
+                    beam_size=10,
+                    n_next_steps=10,
+                    max_iterations=50,
+                    step=0.1,
+                    early_stop=2.0,
+                    apply=False,
+                    start=None,
+                    stats=None,
+                    view=None,
+                    deadline=None):
         '''
         Really simple beam search...
-        No bells and whistles. Not even parallel execution
-        '''
-        model_copy = copy.deepcopy(self.source_model)
-        model_copy.remove_shapes()
-        model_copy.prune_not_containing(self.joint_names | {self.target_name})
-        target_position = model_copy.get(self.target_name).vectors['position']
-        start = collect_parameters(model_copy, self.joint_names)
-        beam = [{p.copy() for p in start} for i in range(beam_size)]
+        No bells and whistles, but the beam is kept as a (candidates x joints) angle array
+        so every iteration scores all candidates in a single batched pass
+        :param start: angle vector (parameters ordered by joint name) to start the beam from,
+        instead of the base angles, or an array of such vectors to fill the beam with.
+        The cost is still the deviation from the base angles
+        Candidates are clipped into the joint limits, and candidates violating the other
+        constraints are ranked after all the valid ones
+        :param stats: SearchStats to record into, a new one by default
+        :param view: SolverView to solve on, the refreshed view of the source model by default
+        :param deadline: time budget in milliseconds from the start of stats. Checked after the
+        setup, and before and after the constraint checks of every iteration, the costly part
+        with self collision.
+        Once spent, candidates not evaluated yet are dropped and the best of the beam is returned
+        '''
+        stats = stats if stats is not None else SearchStats('beam')
+        with stats.phase('setup'):
+            view = view if view is not None else self.solver_view()
+            params, chain, target_position = self.prepare(view)
+            constraints = view.constraints
+        base_angles = np.array([p.base_angle for p in params], dtype=float)
+        if start is None:
+            beam = np.tile(base_angles, (beam_size, 1))
+        else:
+            start = np.atleast_2d(start)
+            beam = start[np.arange(beam_size) % len(start)]
+        beam = constraints.clip(beam)
         gamma = 1.0
         step_mult = 1.0
 
         iterations = 0
-        done = False
-        while not done:
+        best_h = None
+        # the setup may already have spent the budget
+        stop_reason = 'deadline' if stats.deadline_passed(deadline) else None
+        if stop_reason is None:
+            with stats.phase('constraints'):
+                beam_valid = constraints.valid(beam)
+        while stop_reason is None:
+            if stats.deadline_passed(deadline):
+                stop_reason = 'deadline'
+                break
             # get next_step
-            next_steps = []
-            for i in range(n_next_steps):
-                next_step = {p.copy() for p in beam[random.randrange(len(beam))]}
-                for param in next_step:
-                    param.apply_random_step(step * step_mult)
-                next_steps.append(next_step)
+            with stats.phase('candidates'):
+                parents = self.random.integers(len(beam), size=n_next_steps)
+                moves = self.random.integers(-1, 2, size=(n_next_steps, len(params)))
+                next_steps = constraints.clip(beam[parents] + moves * (step * step_mult))
+            candidates = np.concatenate((beam, next_steps))
 
-            # narrow down beam
-            beam.extend(next_steps)
+            with stats.phase('evaluation'):
+                g_scores = np.abs(candidates - base_angles).sum(axis=1)
+                h_scores = self.h_batch(candidates, target_position, chain)
+                scores = gamma * g_scores + h_scores
+            stats.evaluations += len(candidates)
+            if stats.deadline_passed(deadline):
+                stop_reason = 'deadline'
+                break
+            with stats.phase('constraints'):
+                # with a full beam of valid candidates, the new ones not scoring better than
+                # the worst of them are dropped whether valid or not, so they are not checked
+                valid = np.concatenate((beam_valid, np.zeros(len(next_steps), dtype=bool)))
+                checked = np.ones(len(next_steps), dtype=bool)
+                if beam_valid.sum() >= beam_size:
+                    checked = scores[len(beam):] < np.sort(scores[:len(beam)][beam_valid])[beam_size - 1]
+                valid[len(beam):][checked] = constraints.valid(next_steps[checked])
+            if stats.deadline_passed(deadline):
+                stop_reason = 'deadline'
+                break
 
-            g_scores = [sum([p.cost() for p in params]) for params in beam]
-            h_scores = [self.h(params, target_position, model_copy) for params in beam]
-            sorted_beam = sorted(zip(g_scores, h_scores, beam), key=lambda x: gamma * x[0] + x[1])
-            beam = [x for _, _, x in sorted_beam[:beam_size]]
+            # narrow down beam
+            beam = candidates
+            with stats.phase('sorting'):
+                order = np.lexsort((scores, ~valid))[:beam_size]
+                beam = beam[order]
+                beam_valid = valid[order]
+            best_h = h_scores[order[0]]
+            stats.add_iteration(g_scores[order[0]], best_h)
             iterations += 1
-            if iterations == max_iterations:
-                done = True
-            if early_stop is not None and sorted_beam[0][1] <= early_stop:
-                done = True
+            if early_stop is not None and best_h <= early_stop and beam_valid[0]:
+                stop_reason = 'early_stop'
+            elif iterations == max_iterations:
+                stop_reason = 'max_iterations'
             if iterations >= max_iterations / 2:
                 gamma = 0.1
                 step_mult = 0.2
-        print('IK best cost:', sorted_beam[0][0])
 
+        if best_h is None:
+            # the deadline passed before the first iteration
+            best_h = self.h_batch(beam[:1], target_position, chain)[0]
+            stats.evaluations += 1
+        self._finish(stats, stop_reason, best_h)
+        return self._result(params, beam[0], apply)
+
+    def dls_search(self,
+                   max_iterations=20,
+                   damping=5.0,
+                   tolerance=0.5,
+                   secondary_gain=0.1,
+                   apply=False,
+                   start=None,
+                   stats=None,
+                   view=None,
+                   deadline=None):
+        '''
+        Damped least squares: every iteration moves the angles by J^T (J J^T + damping^2 I)^-1 e,
+        where e is the remaining error and J the positional jacobian. The deviation from the
+        base angles (the cost of RotationJointAngleParam) is reduced as a secondary objective,
+        only within the null space of J, so it does not fight the primary one.
+        Angles are clipped into the joint limits, and steps violating the other constraints
+        are halved until they do not, or the search stops
+        :param tolerance: stop once the error is at most this distance
+        :param start: initial angle vector (parameters ordered by joint name), instead of the
+        base angles. For an array of vectors the first one is used
+        :param stats: SearchStats to record into, a new one by default
+        :param view: SolverView to solve on, the refreshed view of the source model by default
+        :param deadline: time budget in milliseconds from the start of stats, checked every
+        iteration and between step halvings. Once spent, the current angles are returned
+        '''
+        stats = stats if stats is not None else SearchStats('dls')
+        with stats.phase('setup'):
+            view = view if view is not None else self.solver_view()
+            params, chain, target_position = self.prepare(view)
+            constraints = view.constraints
+        base_angles = np.array([p.base_angle for p in params], dtype=float)
+        angles = np.array(base_angles if start is None else np.atleast_2d(start)[0], dtype=float)
+        angles = constraints.clip(angles)
+        identity = np.eye(len(params))
+
+        stop_reason = 'max_iterations'
+        for i in range(max_iterations):
+            with stats.phase('evaluation'):
+                position, jacobian = chain.jacobian(angles)
+            stats.evaluations += 1
+            error = target_position - position
+            residual = np.linalg.norm(error, ord=2)
+            stats.add_iteration(np.abs(angles - base_angles).sum(), residual)
+            if residual <= tolerance:
+                stop_reason = 'converged'
+                break
+            if stats.deadline_passed(deadline):
+                stop_reason = 'deadline'
+                break
+            with stats.phase('update'):
+                pseudo_inverse = np.dot(jacobian.T, np.linalg.inv(np.dot(jacobian, jacobian.T) +
+                                                                  damping ** 2 * np.eye(3)))
+                null_space = identity - np.dot(pseudo_inverse, jacobian)
+                delta = np.dot(pseudo_inverse, error) + \
+                    np.dot(null_space, secondary_gain * (base_angles - angles))
+            with stats.phase('constraints'):
+                for _ in range(self.MAX_STEP_HALVINGS + 1):
+                    next_angles = constraints.clip(angles + delta)
+                    if constraints.valid(next_angles)[0]:
+                        break
+                    if stats.deadline_passed(deadline):
+                        stop_reason = 'deadline'
+                        break
+                    delta /= 2
+                else:
+                    stop_reason = 'constrained'
+            if stop_reason != 'max_iterations':
+                break
+            angles = next_angles
+
+        if stop_reason not in ('converged', 'deadline'):
+            residual = self.h_batch(angles, target_position, chain)[0]
+            stats.evaluations += 1
+        self._finish(stats, stop_reason, residual)
+        return self._result(params, angles, apply)
+
+    def analytic_search(self, apply=False, start=None, stats=None, view=None):
+        '''
+        Closed form solution, see model.analytic_ik
+        :param start: angle vector (parameters ordered by joint name) used instead of the base
+        angles to choose between equivalent solutions
+        :param stats: SearchStats to record into, a new one by default
+        :return: None if the kinematic chain is not shaped like an arm, or the solution violates
+        the constraints
+        '''
+        stats = stats if stats is not None else SearchStats('analytic')
+        with stats.phase('setup'):
+            view = view if view is not None else self.solver_view()
+            params, chain, target_position = self.prepare(view)
+            solver = view.get_analytic_solver()
+        if solver is None:
+            return None
+        base_angles = np.array([p.base_angle for p in params], dtype=float)
+        with stats.phase('solve'):
+            angles = solver.solve(target_position, base_angles if start is None else start)
+        with stats.phase('constraints'):
+            if not view.constraints.valid(angles)[0]:
+                return None
+        residual = self.h_batch(angles, target_position, chain)[0]
+        stats.evaluations += 1
+        self._finish(stats, 'closed_form', residual)
+        return self._result(params, angles, apply)
+
+    def prepare(self, view=None):
+        '''
+        :return: the parameters (ordered by joint name), the kinematic chain to the source
+        connection point with a column per parameter, and the target position, from the given
+        view or else the refreshed view of the source model
+        '''
+        if view is None:
+            view = self.solver_view()
+        return view.params, view.chain, view.target_position
+
+    def _finish(self, stats, stop_reason, residual=None):
+        stats.finish(stop_reason, residual)
+        self.last_stats = stats
+        if self.stats_callback is not None:
+            self.stats_callback(stats)
+
+    def _workspace_seeds(self, position, n):
+        '''
+        :return: the angle vectors of the n nearest workspace samples, with columns ordered
+        by joint name like the parameters, or None
+        '''
+        angles, _ = self.workspace.nearest(position, k=n)
+        if len(angles) == 0:
+            return None
+        order = np.argsort(self.workspace.joint_names, kind='stable')
+        return angles[:, order]
+
+    def _result(self, params, angles, apply):
+        best = {RotationJointAngleParam(p.joint_name, p.base_angle, angle) for p, angle in zip(params, angles)}
         if apply:
-            for p in beam[0]:
+            for p in best:
                 p.apply_to_model(self.source_model)
+        return best
 
-        return beam[0]
-
-    def h(self, params, position, model_copy):
-        for p in params:
-            p.apply_to_model(model_copy)
-        model_copy.calc_coords()
-        source = model_copy.get(self.source_element)
-        source_vector = source.get_connection_point_mapped_vector(self.source_connection_point)
-        return np.linalg.norm(position.flatten() - source_vector.flatten(), ord=2)
+    def h_batch(self, angles, position, chain):
+        '''
+        Vectorized h for a (candidates x joints) angle array, with columns ordered as in chain
+        '''
+        return np.linalg.norm(chain.evaluate(angles) - position.flatten(), ord=2, axis=1)
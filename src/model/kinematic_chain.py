@@ -0,0 +1,165 @@
+'''
+The kinematic chain from the model root to a single connection point.
+
+Only the elements on the path to the connection point matter for its position, so the chain
+is reduced to an alternating sequence of fixed homogeneous transforms and free rotation joints.
+This allows evaluating the connection point position for a whole batch of joint angle vectors
+in one pass, instead of setting the angles on a model and running calc_coords per candidate.
+'''
+
+import copy
+import numpy as np
+from model.skeleton_model import RotationJoint
+from model.transformations import get_rotation_matrix, get_rotation_matrix_stack
+
+
+class KinematicChain(object):
+    def __init__(self, model, element_name, connection_point, joint_names):
+        '''
+        :param model: model to take the structure and the angles of the fixed joints from
+        :param element_name: path of the element holding the connection point
+        :param connection_point: name of the connection point, or None for the origin of the
+        element's own coordinates (see transforms)
+        :param joint_names: ordered list of joint paths, one per column of the angle arrays.
+        Joints which are not on the path to the connection point do not affect it and are ignored
+        '''
+        self.joint_names = list(joint_names)
+        self.connection_point = connection_point
+        columns = {name: i for i, name in enumerate(self.joint_names)}
+
+        # (element, child on the path, column if the element is a free joint, else None)
+        self.links = []
+        element = model
+        path = element_name.split('.')
+        for i, n in enumerate(path):
+            if n not in element.child_elements:
+                raise ValueError('No element: ' + '.'.join(path[:i + 1]))
+            child = element.child_elements[n]
+            name = '.'.join(path[:i])
+            column = columns[name] if isinstance(element, RotationJoint) and name in columns else None
+            self.links.append((element, child, column))
+            element = child
+        self.source = element
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Recalculate the fixed transforms from the current state of the model's elements
+        (angles of the joints which are not free, geometry of the bones)
+        :return: self
+        '''
+        # fixed[0], joint[0], fixed[1], joint[1], ..., joint[k-1], fixed[k]
+        self.fixed = []
+        self.columns = []
+        self.axes = []
+        self.origins = []
+        fixed = np.eye(4)
+        for element, child, column in self.links:
+            if column is not None:
+                self.fixed.append(fixed)
+                self.columns.append(column)
+                self.axes.append(element.vectors['axis'].reshape((3,)))
+                self.origins.append(element.vectors['origin'].reshape((3,)))
+                fixed = np.eye(4)
+            else:
+                local = element._child_transform(child)
+                if local is not None:
+                    fixed = np.dot(fixed, local)
+        self.fixed.append(fixed)
+        if self.connection_point is not None:
+            self.point = self.source.vectors['connection_point:' + self.connection_point].reshape((3,))
+        else:
+            self.point = np.zeros(3)
+        return self
+
+    def geometry(self):
+        '''
+        :return: flat array of the fixed transforms, joint axes and origins and the point, e.g. to
+        tell whether refresh changed anything
+        '''
+        return np.concatenate([np.ravel(f) for f in self.fixed] + [np.ravel(a) for a in self.axes] +
+                              [np.ravel(o) for o in self.origins] + [self.point])
+
+    def snapshot(self):
+        '''
+        :return: a copy which does not share any arrays with the model's elements, so it stays
+        valid (e.g. for use on another thread) while the model changes
+        '''
+        chain = copy.copy(self)
+        chain.fixed = [np.copy(f) for f in self.fixed]
+        chain.axes = [np.copy(a) for a in self.axes]
+        chain.origins = [np.copy(o) for o in self.origins]
+        chain.point = np.copy(self.point)
+        return chain
+
+    def evaluate(self, angles):
+        '''
+        :param angles: (n, len(joint_names)) array of joint angles, or a single angle vector
+        :return: (n, 3) array with the connection point position for every angle vector
+        '''
+        angles = np.atleast_2d(angles)
+        # walk the chain backwards, so only points and not full frames are transformed
+        fixed = self.fixed[-1]
+        p = np.tile(np.dot(fixed[:3, :3], self.point) + fixed[:3, 3], (angles.shape[0], 1))
+        for k in range(len(self.columns) - 1, -1, -1):
+            rotations = get_rotation_matrix_stack(self.axes[k], angles[:, self.columns[k]])
+            p = np.einsum('nij,nj->ni', rotations, p - self.origins[k]) + self.origins[k]
+            fixed = self.fixed[k]
+            p = np.dot(p, fixed[:3, :3].T) + fixed[:3, 3]
+        return p
+
+    def joint_transforms(self, angles):
+        '''
+        :param angles: (n, len(joint_names)) array of joint angles, or a single angle vector
+        :return: (n, k, 4, 4) array with the homogeneous transforms of the k free joints on the
+        chain, in chain order
+        '''
+        angles = np.atleast_2d(angles)
+        origins = np.array(self.origins).reshape((-1, 3))
+        local = np.zeros((angles.shape[0], len(self.columns), 4, 4))
+        local[:, :, :3, :3] = get_rotation_matrix_stack(np.array(self.axes).reshape((-1, 3)),
+                                                        angles[:, self.columns])
+        local[:, :, :3, 3] = origins - np.einsum('nkij,kj->nki', local[:, :, :3, :3], origins)
+        local[:, :, 3, 3] = 1
+        return local
+
+    def transforms(self, angles, joint_transforms=None):
+        '''
+        :param angles: (n, len(joint_names)) array of joint angles, or a single angle vector
+        :param joint_transforms: the result of joint_transforms for the angles, if already known
+        (e.g. from another chain through the same joints)
+        :return: (n, 4, 4) array with the homogeneous transform taking the element's own
+        vectors to model coordinates for every angle vector
+        '''
+        angles = np.atleast_2d(angles)
+        world = np.tile(self.fixed[0], (angles.shape[0], 1, 1))
+        if len(self.columns) == 0:
+            return world
+        if joint_transforms is None:
+            joint_transforms = self.joint_transforms(angles)
+        for k in range(len(self.columns)):
+            world = np.matmul(np.matmul(world, joint_transforms[:, k]), self.fixed[k + 1])
+        return world
+
+    def jacobian(self, angles):
+        '''
+        Positional jacobian, built from the mapped (model coordinates) axis and origin of every
+        free joint: a rotation about axis a through origin o moves the point p by a x (p - o)
+        :param angles: a single angle vector
+        :return: connection point position (3,) and the (3, len(joint_names)) jacobian
+        '''
+        world = self.fixed[0]
+        mapped_axes = []
+        mapped_origins = []
+        for k in range(len(self.columns)):
+            axis = self.axes[k] / np.linalg.norm(self.axes[k])
+            mapped_axes.append(np.dot(world[:3, :3], axis))
+            mapped_origins.append(np.dot(world[:3, :3], self.origins[k]) + world[:3, 3])
+            world = np.dot(world, get_rotation_matrix(axis, angles[self.columns[k]], self.origins[k]))
+            world = np.dot(world, self.fixed[k + 1])
+        position = np.dot(world[:3, :3], self.point) + world[:3, 3]
+
+        jacobian = np.zeros((3, len(self.joint_names)))
+        for k in range(len(self.columns)):
+            jacobian[:, self.columns[k]] += np.cross(mapped_axes[k], position - mapped_origins[k])
+        return position, jacobian
@@ -0,0 +1,61 @@
+'''
+The robot used by the gui: a body with two arms, and a hand target per arm.
+'''
+
+from model.skeleton_model import Model, Target
+from model.shapes import get_robot_body, get_robot_arm
+from model.inverse_kinematics import InverseKinematics
+
+ARM_SOURCE_CONNECTION_POINT = 'joint'
+
+
+def arm_source_element(side):
+    return 'body.' + side + '_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3.upper_arm.elbow_joint.lower_arm'
+
+
+def arm_joint_names(side):
+    return {'body.' + side + '_arm.shoulder_joint1',
+            'body.' + side + '_arm.shoulder_joint1.shoulder_joint2',
+            'body.' + side + '_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3',
+            'body.' + side + '_arm.shoulder_joint1.shoulder_joint2.shoulder_joint3.upper_arm.elbow_joint'}
+
+
+def all_joint_names():
+    '''
+    The joints of both arms in a fixed order, e.g. for telemetry and servo channels
+    '''
+    return sorted(arm_joint_names('left')) + sorted(arm_joint_names('right'))
+
+
+def hand_target_name(side):
+    return side + '_hand_target'
+
+
+def build_model():
+    model = Model()
+    body = get_robot_body('body')
+    right_arm = get_robot_arm('right_arm')
+    left_arm = get_robot_arm('left_arm')
+
+    model.add(body)
+    body.add(right_arm, connection_point='right_arm')
+    body.add(left_arm, connection_point='left_arm')
+
+    target_left = Target([0, 0, 100], name=hand_target_name('left'))
+    target_right = Target([0, 0, -100], name=hand_target_name('right'))
+    model.add(target_left)
+    model.add(target_right)
+    model.compile()
+    return model
+
+
+def arm_inverse_kinematics(model, side, **kwargs):
+    '''
+    :param side: 'left' or 'right'
+    :param kwargs: passed on to InverseKinematics
+    '''
+    return InverseKinematics(model, arm_source_element(side),
+                             ARM_SOURCE_CONNECTION_POINT,
+                             hand_target_name(side),
+                             joint_names=arm_joint_names(side),
+                             **kwargs)
@@ -1,10 +1,15 @@
 import numpy as np
-from model.transformations import get_rotation_transform, get_translation_transform
-import random
+from model.transformations import get_rotation_transform, get_translation_transform, \
+    get_rotation_matrix, get_translation_matrix
+from model.forward_kinematics import KinematicTree
+from model.vertex_pool import VertexPool
 
 name_counter = 0
 
 class Element(object):
+    __slots__ = ('parent_element', 'child_elements', 'vectors', 'mapped_vectors', 'dirty', 'mapped_dirty',
+                 'name')
+
     def __init__(self, name=None):
         global name_counter
 
@@ -12,6 +17,10 @@ class Element(object):
         self.child_elements = {}
         self.vectors = {}
         self.mapped_vectors = {}
+        # set when the world transform of this element's subtree, or only its own mapped
+        # vectors, have to be recalculated by compiled forward kinematics
+        self.dirty = True
+        self.mapped_dirty = True
         if name is not None:
             self.name = name
         else:
@@ -23,6 +32,11 @@ class Element(object):
         if element.name in self.child_elements:
             raise ValueError('element with name' + element.name + ' already exist')
         self.child_elements[element.name] = element
+        self._structure_changed()
+
+    def _structure_changed(self):
+        if self.parent_element is not None:
+            self.parent_element._structure_changed()
 
     def _get(self, n):
         if len(n) == 0:
@@ -50,6 +64,7 @@ class Element(object):
     def remove_shapes(self):
         self.child_elements = {n: e for n, e in self.child_elements.items()
                                if not isinstance(self.child_elements[n], Shape)}
+        self._structure_changed()
         for e in self.child_elements.values():
             e.remove_shapes()
 
@@ -65,6 +80,7 @@ class Element(object):
         self.child_elements = {n: e for n, e in self.child_elements.items()
                                if not e.prune_not_containing(keep_elements,
                                                              name + ('.' if name is not '' else '') + n)}
+        self._structure_changed()
         return len(self.child_elements) == 0
 
     def reset_mapped_coords(self):
@@ -82,14 +98,28 @@ class Element(object):
     def _act(self):
         pass
 
-    def transform(self, t):
+    def _child_transform(self, element):
+        '''
+        The homogeneous 4x4 transform _act applies to the subtree of a child element,
+        or None if it leaves it in place. Used by compiled forward kinematics
+        '''
+        return None
 
+    def mark_dirty(self):
+        '''
+        Mark the coordinates of this subtree as stale. Call after modifying vectors in place
+        '''
+        self.dirty = True
+
+    def transform(self, t):
+        self.mark_dirty()
         for n, v in self.vectors.items():
             t(v)
         for e in self.child_elements.values():
             e.transform(t)
 
     def transform_mapped(self, t):
+        self.mapped_dirty = True
         for n, v in self.mapped_vectors.items():
             t(v)
         for e in self.child_elements.values():
@@ -105,22 +135,97 @@ class Element(object):
 
 
 class Model(Element):
+    __slots__ = ('compiled', 'kinematic_tree', 'structure_version', 'path_index', 'vertex_pool')
+
     def __init__(self, name=None):
         Element.__init__(self, name)
+        self.compiled = False
+        self.kinematic_tree = None
+        # incremented on every structure change, so views of the model can tell when to rebuild
+        self.structure_version = 0
+        # path -> element, rebuilt lazily after structure changes
+        self.path_index = None
+        # contiguous storage of the vectors of all elements, rebuilt lazily after structure changes
+        self.vertex_pool = None
+
+    def compile(self):
+        '''
+        Switch calc_coords to compiled forward kinematics (see model.forward_kinematics).
+        The flattened tree is rebuilt lazily whenever the model structure changes.
+        '''
+        self.compiled = True
+        self.kinematic_tree = None
+        return self
+
+    def _structure_changed(self):
+        self.kinematic_tree = None
+        self.path_index = None
+        self.vertex_pool = None
+        self.structure_version += 1
+
+    def __getstate__(self):
+        '''
+        State for copies (deepcopy, pickle). The vertex pool and the flattened tree are left out,
+        the copied elements get copies of their vectors rather than views into a copied pool,
+        so the copy builds its own lazily
+        '''
+        state = {n: getattr(self, n) for c in type(self).__mro__ for n in getattr(c, '__slots__', ())
+                 if hasattr(self, n)}
+        state['vertex_pool'] = None
+        state['kinematic_tree'] = None
+        return state
+
+    def __setstate__(self, state):
+        for n, v in state.items():
+            setattr(self, n, v)
+
+    def get(self, name_path):
+        if self.path_index is None:
+            self.path_index = {n: e for e, n in self.traverse_model() if e is not self}
+        e = self.path_index.get(name_path)
+        if e is None:
+            raise ValueError('No element: ' + name_path)
+        return e
+
+    def get_vertex_pool(self):
+        '''
+        :return: the VertexPool holding the vectors of all elements, see model.vertex_pool
+        '''
+        if self.vertex_pool is None:
+            self.vertex_pool = VertexPool([e for e, _ in self.traverse_model()])
+        return self.vertex_pool
+
+    def reset_mapped_coords(self):
+        self.get_vertex_pool().reset()
+
+    def transform(self, t):
+        # the vectors of all elements are the rows of the vertex pool, transform them at once
+        t(self.get_vertex_pool().source)
+        self.mark_dirty()
 
     def calc_coords(self):
-        self.reset_mapped_coords()
-        self.act()
+        if self.compiled:
+            vertex_pool = self.get_vertex_pool()
+            if self.kinematic_tree is None or self.kinematic_tree.vertex_pool is not vertex_pool:
+                self.kinematic_tree = KinematicTree(self, vertex_pool)
+            self.kinematic_tree.calc_coords()
+        else:
+            self.reset_mapped_coords()
+            self.act()
 
 
 class Bone(Element):
+    __slots__ = ('connection_points',)
+
     def __init__(self, name=None):
         Element.__init__(self, name)
         self.connection_points = {}
 
     def add_connection_point(self, name, coords):
-        self.vectors['connection_point:'+name] = np.array(coords, ndmin=2)
+        self.vectors['connection_point:'+name] = np.array(coords, dtype=float, ndmin=2)
         self.connection_points[name] = []
+        # a new vector, which the model's vertex pool has to include
+        self._structure_changed()
 
     def get_connection_point_mapped_vector(self, name):
         return self.mapped_vectors['connection_point:'+name]
@@ -138,13 +243,37 @@ class Bone(Element):
                 if element_name in self.child_elements:
                     self.child_elements[element_name].transform_mapped(t)
 
+    def _child_transform(self, element):
+        matrix = None
+        for connection_point, elements in self.connection_points.items():
+            if element.name in elements:
+                t = get_translation_matrix(self.vectors['connection_point:'+connection_point].reshape((3,)))
+                matrix = t if matrix is None else np.dot(t, matrix)
+        return matrix
+
 
 class RotationJoint(Element):
-    def __init__(self, origin, axis, angle, name=None):
+    __slots__ = ('_angle', 'limits')
+
+    def __init__(self, origin, axis, angle, name=None, limits=None):
+        '''
+        :param limits: (lower, upper) bounds of the angle, or None. Respected by the inverse
+        kinematics solvers (see model.constraints), setting the angle directly is not limited
+        '''
         Element.__init__(self, name)
-        self.vectors['origin'] = np.array(origin, ndmin=2)
-        self.vectors['axis'] = np.array(axis, ndmin=2)
+        self.vectors['origin'] = np.array(origin, dtype=float, ndmin=2)
+        self.vectors['axis'] = np.array(axis, dtype=float, ndmin=2)
         self.angle = angle
+        self.limits = limits
+
+    @property
+    def angle(self):
+        return self._angle
+
+    @angle.setter
+    def angle(self, angle):
+        self._angle = angle
+        self.mark_dirty()
 
     def _act(self):
         t = get_rotation_transform(self.mapped_vectors['axis'].reshape((3,)),
@@ -153,6 +282,11 @@ class RotationJoint(Element):
         for e in self.child_elements.values():
             e.transform_mapped(t)
 
+    def _child_transform(self, element):
+        # the joint's own mapped vectors are still untouched by its ancestors when it acts
+        return get_rotation_matrix(self.vectors['axis'].reshape((3,)),
+                                   self.angle,
+                                   self.vectors['origin'].reshape((3,)))
 
     def _draw(self, canvas):
         canvas.create_oval(self.mapped_vectors['origin'][0, 0] - 2,
@@ -162,9 +296,15 @@ class RotationJoint(Element):
 
 
 class Target(Element):
+    __slots__ = ()
+
     def __init__(self, position, name=None):
         Element.__init__(self, name)
-        self.vectors['position'] = np.array(position, ndmin=2)
+        self.vectors['position'] = np.array(position, dtype=float, ndmin=2)
+
+    def set_position(self, position):
+        self.vectors['position'][:] = position
+        self.mark_dirty()
 
     def _draw(self, canvas):
         canvas.create_oval(self.mapped_vectors['position'][0, 0] - 4,
@@ -174,6 +314,8 @@ class Target(Element):
 
 
 class Shape(Element):
+    __slots__ = ('lines',)
+
     def __init__(self, vertices, lines, name=None):
         Element.__init__(self, name)
         self.vectors['vertices'] = vertices
@@ -0,0 +1,175 @@
+'''
+Binary snapshots of a model.
+
+A snapshot is a single uncompressed .npz file holding the element tree (types, names, parents
+and the connection points children are attached to), joint angles and limits, shape lines, and
+all the vectors of the model as the source array of its VertexPool. Optionally it also holds the
+compiled forward kinematics state (world transforms and mapped coordinates), so the loaded model
+needs no calc_coords before it is drawn, and IK solutions by target name.
+
+Loading with mmap=True maps the vectors straight from the file (copy on write) instead of
+reading them, so processes loading the same snapshot share the geometry pages.
+'''
+
+import zipfile
+import numpy as np
+from model.skeleton_model import Element, Model, Bone, RotationJoint, Target, Shape
+from model.vertex_pool import VertexPool
+from model.forward_kinematics import KinematicTree
+from model.inverse_kinematics import RotationJointAngleParam
+
+_ELEMENT_TYPES = {t.__name__: t for t in (Element, Model, Bone, RotationJoint, Target, Shape)}
+
+
+def _preorder(element, parent, elements, parents):
+    index = len(elements)
+    elements.append(element)
+    parents.append(parent)
+    for e in element.child_elements.values():
+        _preorder(e, index, elements, parents)
+
+
+def save_snapshot(model, path, solutions=None, state=True):
+    '''
+    :param solutions: optional dict from target name to an IK solution (a set of
+    RotationJointAngleParam, as returned by InverseKinematics.search)
+    :param state: include the compiled forward kinematics state of compiled models
+    '''
+    elements = []
+    parents = []
+    _preorder(model, -1, elements, parents)
+    index = {e: i for i, e in enumerate(elements)}
+    vertex_pool = model.get_vertex_pool()
+
+    attachments = []
+    for element in elements:
+        attachment = ''
+        if isinstance(element.parent_element, Bone):
+            for connection_point, names in element.parent_element.connection_points.items():
+                if element.name in names:
+                    attachment = connection_point
+        attachments.append(attachment)
+
+    lines = [np.array(e.lines, dtype=np.int64).reshape((-1, 2)) if isinstance(e, Shape)
+             else np.zeros((0, 2), dtype=np.int64) for e in elements]
+    limits = [e.limits if isinstance(e, RotationJoint) and e.limits is not None else (np.nan, np.nan)
+              for e in elements]
+    arrays = {'types': np.array([type(e).__name__ for e in elements]),
+              'names': np.array([e.name for e in elements]),
+              'parents': np.array(parents, dtype=np.int64),
+              'attachments': np.array(attachments),
+              'angles': np.array([e.angle if isinstance(e, RotationJoint) else np.nan for e in elements],
+                                 dtype=float),
+              'limits': np.array(limits, dtype=float),
+              'lines': np.concatenate(lines),
+              'line_offsets': np.cumsum([0] + [len(l) for l in lines]),
+              'vertices': vertex_pool.source,
+              'vector_elements': np.array([index[e] for e, _, _, _ in vertex_pool.ranges], dtype=np.int64),
+              'vector_names': np.array([n for _, n, _, _ in vertex_pool.ranges]),
+              'vector_rows': np.array([start for _, _, start, _ in vertex_pool.ranges] + [len(vertex_pool)],
+                                      dtype=np.int64),
+              'compiled': np.array(model.compiled)}
+
+    if state and model.compiled:
+        model.calc_coords()
+        arrays['world'] = model.kinematic_tree.world
+        arrays['mapped'] = vertex_pool.mapped
+
+    if solutions is not None:
+        targets = sorted(solutions)
+        params = [sorted(solutions[t], key=lambda p: p.joint_name) for t in targets]
+        arrays['solution_targets'] = np.array(targets)
+        arrays['solution_offsets'] = np.cumsum([0] + [len(p) for p in params])
+        arrays['solution_joint_names'] = np.array([p.joint_name for ps in params for p in ps])
+        arrays['solution_angles'] = np.array([[p.base_angle, p.angle] for ps in params for p in ps],
+                                             dtype=float).reshape((-1, 2))
+    np.savez(path, **arrays)
+
+
+def _mmap_member(path, name):
+    '''
+    Memory map an array stored in an uncompressed .npz file, copy on write
+    '''
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError('cannot memory map a compressed snapshot')
+    with open(path, 'rb') as f:
+        # the local file header has its own name and extra field lengths
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def load_snapshot(path, mmap=False):
+    '''
+    :param mmap: map the vectors from the file instead of reading them, see module docstring
+    :return: the model, and the dict of solutions by target name (empty if none were saved)
+    '''
+    with np.load(path) as data:
+        data = {n: data[n] for n in data.files if not (mmap and n == 'vertices')}
+    vertices = _mmap_member(path, 'vertices') if mmap else data['vertices']
+
+    vectors = [{} for _ in data['types']]
+    rows = data['vector_rows']
+    for i, (element, name) in enumerate(zip(data['vector_elements'], data['vector_names'])):
+        vectors[element][str(name)] = vertices[rows[i]:rows[i + 1]]
+
+    elements = []
+    for i, (element_type, name, parent) in enumerate(zip(data['types'], data['names'], data['parents'])):
+        element_type = _ELEMENT_TYPES[str(element_type)]
+        name = str(name)
+        v = vectors[i]
+        if element_type is RotationJoint:
+            limits = tuple(data['limits'][i].tolist()) if not np.isnan(data['limits'][i]).any() else None
+            element = RotationJoint(v['origin'], v['axis'], float(data['angles'][i]), name, limits)
+        elif element_type is Target:
+            element = Target(v['position'], name)
+        elif element_type is Shape:
+            lines = data['lines'][data['line_offsets'][i]:data['line_offsets'][i + 1]]
+            element = Shape(v['vertices'], [tuple(l) for l in lines.tolist()], name)
+        else:
+            element = element_type(name)
+        if element_type is Bone:
+            for n in v:
+                if n.startswith('connection_point:'):
+                    element.connection_points[n[len('connection_point:'):]] = []
+        # views into the pool source, in pool order
+        element.vectors = v
+        elements.append(element)
+        if parent >= 0:
+            attachment = str(data['attachments'][i])
+            if attachment != '':
+                elements[parent].add(element, connection_point=attachment)
+            else:
+                elements[parent].add(element)
+
+    model = elements[0]
+    model.vertex_pool = VertexPool([e for e, _ in model.traverse_model()], source=vertices)
+    if bool(data['compiled']):
+        model.compile()
+    if 'world' in data:
+        model.kinematic_tree = KinematicTree(model, model.vertex_pool)
+        model.kinematic_tree.world = data['world']
+        model.vertex_pool.mapped[:] = data['mapped']
+        for element in elements:
+            element.dirty = False
+            element.mapped_dirty = False
+
+    solutions = {}
+    if 'solution_targets' in data:
+        offsets = data['solution_offsets']
+        for i, target in enumerate(data['solution_targets']):
+            solutions[str(target)] = {RotationJointAngleParam(str(n), float(base_angle), float(angle))
+                                      for n, (base_angle, angle) in
+                                      zip(data['solution_joint_names'][offsets[i]:offsets[i + 1]],
+                                          data['solution_angles'][offsets[i]:offsets[i + 1]])}
+    return model, solutions
@@ -0,0 +1,60 @@
+'''
+Time parameterized joint space paths.
+
+A trajectory moves all joints from a start to an end angle vector along a cubic (smoothstep)
+profile, starting and ending at rest. Its duration is the shortest one that keeps every joint
+within its velocity limit. Waypoints are computed in vectorized chunks and consumed through a
+generator, so a controller can start sending the first ones before the rest are computed.
+'''
+
+import math
+import numpy as np
+
+# peak velocity of the smoothstep profile, relative to the average velocity
+_PEAK_VELOCITY = 1.5
+
+
+class Trajectory(object):
+    def __init__(self, joint_names, start, end, max_velocity, dt=0.01):
+        '''
+        :param joint_names: joint name per column of the angle vectors
+        :param start: start angle vector
+        :param end: end angle vector
+        :param max_velocity: velocity limit in radians per second, for all joints or per joint
+        :param dt: time between waypoints, in seconds
+        '''
+        self.joint_names = list(joint_names)
+        self.start = np.array(start, dtype=float)
+        self.end = np.array(end, dtype=float)
+        self.max_velocity = np.broadcast_to(np.asarray(max_velocity, dtype=float), self.start.shape)
+        self.dt = dt
+        self.duration = float(np.max(_PEAK_VELOCITY * np.abs(self.end - self.start) / self.max_velocity,
+                                     initial=0.0))
+        self.n_waypoints = int(math.ceil(self.duration / dt)) + 1
+
+    def __len__(self):
+        return self.n_waypoints
+
+    def sample(self, times):
+        '''
+        :param times: array of times, in seconds from the start
+        :return: (len(times), n_joints) angles at these times
+        '''
+        if self.duration == 0:
+            return np.tile(self.end, (len(times), 1))
+        s = np.clip(np.asarray(times, dtype=float) / self.duration, 0.0, 1.0)
+        s = s * s * (3 - 2 * s)
+        return self.start + s.reshape((-1, 1)) * (self.end - self.start)
+
+    def waypoints(self, chunk_size=64):
+        '''
+        Generator of (time, angle vector) waypoints, from the start to the end (inclusive)
+        '''
+        for first in range(0, self.n_waypoints, chunk_size):
+            times = np.minimum(np.arange(first, min(first + chunk_size, self.n_waypoints)) * self.dt,
+                               self.duration)
+            for t, angles in zip(times, self.sample(times)):
+                yield t, angles
+
+    def __iter__(self):
+        return self.waypoints()
@@ -2,30 +2,132 @@ import numpy as np
 import math
 
 
+class Transform(object):
+    '''
+    Affine transform backed by a homogeneous 4x4 matrix. Transforms compose with @ (a @ b
+    applies b first) and invert, so a chain of them is applied as a single matrix product.
+    Calling a transform applies it in place to an (n, 3) array, like the closures returned by
+    the get_*_transform helpers, so it can be passed to Element.transform
+    '''
+    def __init__(self, matrix=None):
+        self.matrix = np.eye(4) if matrix is None else np.array(matrix, dtype=float)
+
+    @staticmethod
+    def translation(translation):
+        return Transform(get_translation_matrix(translation))
+
+    @staticmethod
+    def rotation(axis, angle, origin=np.zeros(3)):
+        return Transform(get_rotation_matrix(axis, angle, origin))
+
+    @staticmethod
+    def scale(scale):
+        matrix = np.eye(4)
+        matrix[:3, :3] *= scale
+        return Transform(matrix)
+
+    def __matmul__(self, other):
+        if not isinstance(other, Transform):
+            return NotImplemented
+        return Transform(np.dot(self.matrix, other.matrix))
+
+    def inverse(self):
+        return Transform(np.linalg.inv(self.matrix))
+
+    def apply(self, coords):
+        '''
+        :return: the transformed (n, 3) coordinates, as a new array
+        '''
+        return np.dot(coords, self.matrix[:3, :3].T) + self.matrix[:3, 3]
+
+    def __call__(self, coords):
+        np.add(np.dot(coords, self.matrix[:3, :3].T), self.matrix[:3, 3], out=coords, casting='unsafe')
+
+
+class PerspectiveTransform(object):
+    '''
+    The fake perspective (x and y scaled by focal_distance / z, z kept), applied after an affine
+    transform. Not affine, so it is kept apart from Transform: it can only be composed with
+    affine transforms applied before it, and has no inverse
+    '''
+    def __init__(self, focal_distance, affine=None):
+        self.focal_distance = focal_distance
+        self.affine = affine if affine is not None else Transform()
+
+    def __matmul__(self, other):
+        if not isinstance(other, Transform):
+            return NotImplemented
+        return PerspectiveTransform(self.focal_distance, self.affine @ other)
+
+    def apply(self, coords):
+        coords = self.affine.apply(coords)
+        coords[:, 0:2] *= self.focal_distance / coords[:, 2:3]
+        return coords
+
+    def __call__(self, coords):
+        coords[:, :] = self.apply(coords)
+
+
 def get_translation_transform(translation):
-    def _f(coords):
-        coords[:, :] = coords + translation
-    return _f
+    return Transform.translation(translation)
 
 
 def get_scale_transform(scale):
-    def _f(coords):
-        coords[:, :] = coords * scale
-    return _f
+    return Transform.scale(scale)
 
 
 def get_rotation_transform(axis, angle, origin=np.zeros(3)):
-    matrix = _rotation_matrix(axis, angle)
-    def _f(coords):
-        coords[:, :] = coords - origin
-        coords[:, :] = np.dot(matrix, coords.T).T
-        coords[:, :] = coords + origin
-    return _f
+    return Transform.rotation(axis, angle, origin)
+
+def get_translation_matrix(translation):
+    '''
+    Homogeneous 4x4 counterpart of get_translation_transform
+    '''
+    matrix = np.eye(4)
+    matrix[:3, 3] = translation
+    return matrix
+
+
+def get_rotation_matrix(axis, angle, origin=np.zeros(3)):
+    '''
+    Homogeneous 4x4 counterpart of get_rotation_transform
+    '''
+    rotation = _rotation_matrix(axis, angle)
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = origin - np.dot(rotation, origin)
+    return matrix
+
+
+def get_rotation_matrix_stack(axis, angles):
+    '''
+    Vectorized _rotation_matrix: one 3x3 rotation per angle, about the same axis, or about
+    axes broadcast against the angles (e.g. (k, 3) axes for (n, k) angles)
+    :return: (len(angles), 3, 3) array, or angles.shape + (3, 3) in general
+    '''
+    axis = np.asarray(axis, dtype=float)
+    axis = axis / np.sqrt((axis * axis).sum(axis=-1, keepdims=True))
+    angles = np.asarray(angles, dtype=float)
+    a = np.cos(angles / 2.0)
+    sin = np.sin(angles / 2.0)
+    b, c, d = -axis[..., 0] * sin, -axis[..., 1] * sin, -axis[..., 2] * sin
+    aa, bb, cc, dd = a * a, b * b, c * c, d * d
+    bc, ad, ac, ab, bd, cd = b * c, a * d, a * c, a * b, b * d, c * d
+    matrices = np.empty(b.shape + (3, 3))
+    matrices[..., 0, 0] = aa + bb - cc - dd
+    matrices[..., 0, 1] = 2 * (bc + ad)
+    matrices[..., 0, 2] = 2 * (bd - ac)
+    matrices[..., 1, 0] = 2 * (bc - ad)
+    matrices[..., 1, 1] = aa + cc - bb - dd
+    matrices[..., 1, 2] = 2 * (cd + ab)
+    matrices[..., 2, 0] = 2 * (bd + ac)
+    matrices[..., 2, 1] = 2 * (cd - ab)
+    matrices[..., 2, 2] = aa + dd - bb - cc
+    return matrices
+
 
 def get_fake_perspective_transform(focal_distance):
-    def _f(coords):
-        coords[:, 0:2] = coords[:, 0:2] * focal_distance / coords[:, 2].reshape((coords.shape[0], 1))
-    return _f
+    return PerspectiveTransform(focal_distance)
 
 
 def _rotation_matrix(axis, theta):
@@ -0,0 +1,66 @@
+'''
+Contiguous storage of all the coordinates of a model.
+
+Elements keep their vectors (shape vertices, connection points, joint origins and axes, target
+positions) in dicts of small separate arrays. A VertexPool packs all of them into one (n, 3)
+float array, and the mapped vectors into another, and rebinds the elements' dicts to views of
+rows of these arrays. Resetting the mapped coordinates then is a single copy, forward
+kinematics can map all rows in one operation, and the whole model can be transformed in bulk.
+'''
+
+import numpy as np
+
+
+class VertexPool(object):
+    def __init__(self, elements, source=None):
+        '''
+        Copies the vectors of the elements into the pool and rebinds vectors and mapped_vectors
+        of every element to views into it. Vectors must be (k, 3) arrays, and have to be modified
+        in place (e.g. by Element.transform) from now on for the pool to see the changes
+        :param elements: the elements to pool, e.g. all elements of a model
+        :param source: (n, 3) array already holding the vectors of the elements in pool order,
+        e.g. the source of a saved pool (see model.snapshot), used as is instead of a copy
+        '''
+        # (element, vector name, first row, end row)
+        self.ranges = []
+        n_rows = 0
+        for element in elements:
+            for n, v in element.vectors.items():
+                self.ranges.append((element, n, n_rows, n_rows + v.shape[0]))
+                n_rows += v.shape[0]
+
+        self.mapped = np.empty((n_rows, 3))
+        if source is not None:
+            if source.shape != (n_rows, 3):
+                raise ValueError('source does not match the vectors of the elements')
+            self.source = source
+        else:
+            self.source = np.empty((n_rows, 3))
+            for element, n, start, end in self.ranges:
+                self.source[start:end] = element.vectors[n]
+        for element in elements:
+            element.vectors = {}
+            element.mapped_vectors = {}
+        for element, n, start, end in self.ranges:
+            element.vectors[n] = self.source[start:end]
+            element.mapped_vectors[n] = self.mapped[start:end]
+        self.reset()
+
+    def __len__(self):
+        return self.source.shape[0]
+
+    def element_rows(self, index):
+        '''
+        :param index: dict from element to an integer, e.g. its position in a flattened tree
+        :return: (n_rows,) array, the integer of the element owning each row
+        '''
+        rows = np.empty(len(self), dtype=int)
+        for element, _, start, end in self.ranges:
+            rows[start:end] = index[element]
+        return rows
+
+    def reset(self):
+        '''
+        Set all mapped vectors back to the element's own vectors
+        '''
+        np.copyto(self.mapped, self.source)
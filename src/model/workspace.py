@@ -0,0 +1,119 @@
+'''
+Precomputed reachable workspace of a kinematic chain.
+
+The angle space of the chain's joints is sampled offline through forward kinematics, and the
+resulting end effector positions are bucketed with their angle vectors in a voxel grid, stored
+as cell keys sorted for binary search. At solve time this gives the nearest known configurations
+to seed a search with, and rejects targets far from every sample without searching at all.
+
+Build the indices of the gui robot's arms with:
+    python -m model.workspace <output directory>
+'''
+
+import math
+import os
+import sys
+import numpy as np
+
+_CELL_BITS = 20
+_CELL_OFFSET = 1 << (_CELL_BITS - 1)
+
+
+def _cell_keys(cells):
+    cells = cells.astype(np.int64) + _CELL_OFFSET
+    return (cells[..., 0] << (2 * _CELL_BITS)) | (cells[..., 1] << _CELL_BITS) | cells[..., 2]
+
+
+class WorkspaceIndex(object):
+    def __init__(self, positions, angles, voxel_size, joint_names, source_element, source_connection_point):
+        '''
+        :param positions: (n, 3) sampled end effector positions
+        :param angles: (n, len(joint_names)) angle vectors reaching them
+        '''
+        self.voxel_size = float(voxel_size)
+        self.joint_names = list(joint_names)
+        self.source_element = source_element
+        self.source_connection_point = source_connection_point
+
+        keys = _cell_keys(np.floor(positions / self.voxel_size))
+        order = np.argsort(keys, kind='stable')
+        self.positions = positions[order]
+        self.angles = angles[order]
+        self.cell_keys, self.cell_starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        self.cell_ends = self.cell_starts + counts
+
+        r = np.arange(-1, 2)
+        self.neighbourhood = np.stack(np.meshgrid(r, r, r, indexing='ij'), axis=-1).reshape((-1, 3))
+
+    @staticmethod
+    def build(inverse_kinematics, n_samples=200000, angle_range=math.pi, voxel_size=10.0, seed=None,
+              batch_size=10000):
+        '''
+        Sample the angle space of the joints of an InverseKinematics solver
+        :param angle_range: angles are sampled uniformly within this distance of the current angles
+        '''
+        random = np.random.default_rng(seed)
+        params, chain, _ = inverse_kinematics.prepare()
+        base_angles = np.array([p.base_angle for p in params], dtype=float)
+        angles = random.uniform(base_angles - angle_range, base_angles + angle_range,
+                                size=(n_samples, len(params)))
+        positions = np.empty((n_samples, 3))
+        for i in range(0, n_samples, batch_size):
+            positions[i:i + batch_size] = chain.evaluate(angles[i:i + batch_size])
+        return WorkspaceIndex(positions, angles, voxel_size, chain.joint_names,
+                              inverse_kinematics.source_element,
+                              inverse_kinematics.source_connection_point)
+
+    def _candidates(self, position):
+        '''
+        :return: indices of the samples in the voxel of position and the voxels around it
+        '''
+        cell = np.floor(np.asarray(position, dtype=float).flatten() / self.voxel_size)
+        keys = _cell_keys(cell + self.neighbourhood)
+        slots = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        found = slots[self.cell_keys[slots] == keys]
+        if len(found) == 0:
+            return np.zeros(0, dtype=int)
+        return np.concatenate([np.arange(self.cell_starts[i], self.cell_ends[i]) for i in found])
+
+    def nearest(self, position, k=1):
+        '''
+        :return: up to k (angles, distance) pairs as two arrays, nearest first. Only samples at
+        most one voxel away are considered, so both arrays are empty for unreachable targets
+        '''
+        candidates = self._candidates(position)
+        distances = np.linalg.norm(self.positions[candidates] - np.asarray(position).flatten(), ord=2, axis=1)
+        order = np.argsort(distances)[:k]
+        return self.angles[candidates[order]], distances[order]
+
+    def is_reachable(self, position):
+        '''
+        False if no sampled position is within a voxel of the target
+        '''
+        return len(self._candidates(position)) > 0
+
+    def save(self, path):
+        np.savez(path,
+                 positions=self.positions,
+                 angles=self.angles,
+                 voxel_size=self.voxel_size,
+                 joint_names=np.array(self.joint_names),
+                 source=np.array([self.source_element, self.source_connection_point]))
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            source_element, source_connection_point = data['source']
+            return WorkspaceIndex(data['positions'], data['angles'], data['voxel_size'],
+                                  [str(n) for n in data['joint_names']],
+                                  str(source_element), str(source_connection_point))
+
+
+if __name__ == '__main__':
+    from model.robot import build_model, arm_inverse_kinematics
+
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else '.'
+    model = build_model()
+    for side in ('left', 'right'):
+        index = WorkspaceIndex.build(arm_inverse_kinematics(model, side), seed=0)
+        index.save(os.path.join(output_dir, side + '_arm_workspace.npz'))
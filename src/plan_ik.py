@@ -0,0 +1,153 @@
+'''
+Solves inverse kinematics for a file of hand target positions, without the gui.
+
+Targets are read from a CSV file (x,y,z per line, lines starting with # are skipped) or a .npy
+file with an (n, 3) array, in chunks. The chunks are solved in parallel by a pool of worker
+processes, each holding its own model and solver, and the solutions are written to the output
+CSV file in input order as they complete. Only a few chunks per worker are in flight at any
+time, so memory stays bounded however large the input is.
+
+Usage (from the src directory):
+    python plan_ik.py <targets.csv|targets.npy> <output.csv> [options]
+'''
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import os
+import numpy as np
+from model.robot import build_model, arm_inverse_kinematics, arm_joint_names
+from model.inverse_kinematics import InverseKinematics
+from model.snapshot import load_snapshot
+from model.workspace import WorkspaceIndex
+
+# set up in every worker process by _init_worker
+_model = None
+_inverse_kinematics = None
+_search_kwargs = None
+_seed = None
+
+
+def _init_worker(snapshot, side, solver, self_collision, workspace, seed, search_kwargs):
+    global _model, _inverse_kinematics, _search_kwargs, _seed
+    # workers share the geometry of the snapshot through the page cache
+    _model = load_snapshot(snapshot, mmap=True)[0] if snapshot is not None else build_model()
+    _inverse_kinematics = arm_inverse_kinematics(_model, side,
+                                                 solver=solver,
+                                                 self_collision=self_collision,
+                                                 workspace=WorkspaceIndex.load(workspace) if workspace else None)
+    _search_kwargs = search_kwargs
+    _seed = seed
+
+
+def _solve_chunk(chunk_index, targets):
+    '''
+    The random generator is seeded from the seed and the chunk index, so the results do not
+    depend on which worker solves the chunk
+    :return: (n, joints) angles ordered by joint name (nan if unreachable), residuals and stop reasons
+    '''
+    _inverse_kinematics.random = np.random.default_rng([_seed, chunk_index])
+    target = _model.get(_inverse_kinematics.target_name)
+    angles = np.full((len(targets), len(_inverse_kinematics.joint_names)), np.nan)
+    residuals = np.full(len(targets), np.nan)
+    stop_reasons = []
+    for i, position in enumerate(targets):
+        target.set_position(position)
+        result = _inverse_kinematics.search(apply=False, **_search_kwargs)
+        stats = _inverse_kinematics.last_stats
+        if result is not None:
+            angles[i] = [p.angle for p in sorted(result, key=lambda p: p.joint_name)]
+            residuals[i] = stats.residual if stats.residual is not None else np.nan
+        stop_reasons.append(stats.stop_reason)
+    return angles, residuals, stop_reasons
+
+
+def read_targets(path, chunk_size):
+    '''
+    :return: generator of (k, 3) arrays of at most chunk_size targets
+    '''
+    if path.endswith('.npy'):
+        targets = np.load(path, mmap_mode='r')
+        for start in range(0, len(targets), chunk_size):
+            yield np.array(targets[start:start + chunk_size], dtype=float).reshape((-1, 3))
+        return
+    with open(path) as f:
+        chunk = []
+        for row in csv.reader(line for line in f if line.strip() and not line.startswith('#')):
+            chunk.append([float(x) for x in row[:3]])
+            if len(chunk) == chunk_size:
+                yield np.array(chunk)
+                chunk = []
+        if chunk:
+            yield np.array(chunk)
+
+
+def plan(targets_path, output_path, snapshot=None, side='left', solver='dls', self_collision=False,
+         workspace=None, workers=None, chunk_size=256, seed=0, **search_kwargs):
+    '''
+    :param seed: seed of the solvers' random generators, the same seed gives the same results
+    :param search_kwargs: passed on to InverseKinematics.search
+    :return: number of targets solved
+    '''
+    workers = workers or os.cpu_count() or 1
+    joint_names = sorted(arm_joint_names(side))
+    n_solved = 0
+    with open(output_path, 'w', newline='') as f, \
+            concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                   initargs=(snapshot, side, solver, self_collision,
+                                                             workspace, seed, search_kwargs)) as pool:
+        writer = csv.writer(f)
+        writer.writerow(['x', 'y', 'z'] + joint_names + ['residual', 'stop_reason'])
+        in_flight = collections.deque()
+
+        def write_oldest():
+            targets, future = in_flight.popleft()
+            angles, residuals, stop_reasons = future.result()
+            for position, a, residual, stop_reason in zip(targets, angles, residuals, stop_reasons):
+                writer.writerow(['%.6g' % x for x in position] + ['%.9g' % x for x in a] +
+                                ['%.6g' % residual, stop_reason])
+            return len(targets)
+
+        for chunk_index, targets in enumerate(read_targets(targets_path, chunk_size)):
+            if len(in_flight) >= 2 * workers:
+                n_solved += write_oldest()
+            in_flight.append((targets, pool.submit(_solve_chunk, chunk_index, targets)))
+        while in_flight:
+            n_solved += write_oldest()
+    return n_solved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', help='CSV or .npy file of target positions')
+    parser.add_argument('output', help='CSV file to write the solutions to')
+    parser.add_argument('--snapshot', default=None, help='model snapshot to load (see model.snapshot), '
+                                                         'the gui robot by default')
+    parser.add_argument('--side', default='left', choices=('left', 'right'))
+    parser.add_argument('--solver', default='dls', choices=InverseKinematics.SOLVERS)
+    parser.add_argument('--self-collision', action='store_true', help='reject self colliding solutions')
+    parser.add_argument('--workspace', default=None, help='workspace index of the arm (see model.workspace)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per core by default')
+    parser.add_argument('--chunk-size', type=int, default=256, help='targets per worker task')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the solvers, for reproducible results')
+    parser.add_argument('--max-iterations', type=int, default=50)
+    parser.add_argument('--deadline', type=float, default=None, help='time budget per target in milliseconds')
+    args = parser.parse_args()
+
+    n_solved = plan(args.targets, args.output,
+                    snapshot=args.snapshot,
+                    side=args.side,
+                    solver=args.solver,
+                    self_collision=args.self_collision,
+                    workspace=args.workspace,
+                    workers=args.workers,
+                    chunk_size=args.chunk_size,
+                    seed=args.seed,
+                    max_iterations=args.max_iterations,
+                    deadline=args.deadline)
+    print('solved %d targets' % n_solved)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,34 @@
-import tkinter as tk
+'''
+Reads joint telemetry from the robot's serial port and prints the measured pose.
 
-# if you are still working under a Python 2 version,
-# comment out the previous line and uncomment the following line
-# import Tkinter as tk
+Usage (from the src directory):
+    python read_serial.py <port> [baudrate]
+'''
 
-root = tk.Tk()
+import sys
+import time
+from hardware.telemetry import TelemetryReader
+from model.robot import build_model, all_joint_names
 
-w = tk.Label(root, text="Hello Tkinter!")
-w.pack()
 
-root.mainloop()
\ No newline at end of file
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    baudrate = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    reader = TelemetryReader.open(sys.argv[1], all_joint_names(), baudrate=baudrate)
+    model = build_model()
+    try:
+        while True:
+            time.sleep(0.1)
+            if reader.poll() > 0:
+                reader.apply_to_model(model)
+                print(reader.stats(), ' '.join('%.3f' % a for a in reader.latest_pose().values()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import numpy as np
+from model.constraints import SelfCollision
+from model.robot import build_model, arm_joint_names
+from model.skeleton_model import RotationJoint, Shape
+from model.transformations import get_scale_transform
+
+
+def _check_fresh(model, collision, angles):
+    collision.refresh()
+    colliding = collision.colliding(angles)
+    assert np.array_equal(colliding, SelfCollision(model, collision.joint_names).colliding(angles))
+    return colliding
+
+
+def test_refresh_follows_the_model():
+    model = build_model()
+    joint_names = sorted(arm_joint_names('left'))
+    collision = SelfCollision(model, joint_names)
+    angles = np.random.default_rng(0).uniform(-2.5, 2.5, size=(300, len(joint_names)))
+    before = _check_fresh(model, collision, angles)
+
+    # the joints which are not free pose the static links
+    for element, path in model.traverse_model():
+        if isinstance(element, RotationJoint) and path not in joint_names:
+            element.angle = 1.0
+    posed = _check_fresh(model, collision, angles)
+
+    body = [e for e in model.get('body').child_elements.values() if isinstance(e, Shape)][0]
+    body.transform(get_scale_transform(1.3))
+    scaled = _check_fresh(model, collision, angles)
+    assert not np.array_equal(before, posed)
+    assert not np.array_equal(posed, scaled)
@@ -0,0 +1,108 @@
+import copy
+import numpy as np
+from model.robot import build_model
+from model.shapes import get_robot_arm
+from model.skeleton_model import RotationJoint
+from model.transformations import Transform
+
+
+def _models():
+    '''
+    :return: the same model twice, with compiled and with the recursive (legacy) forward kinematics
+    '''
+    compiled = build_model()
+    # a copy, since unnamed elements (e.g. shapes) are named by a global counter
+    legacy = copy.deepcopy(compiled)
+    legacy.compiled = False
+    return compiled, legacy
+
+
+def _assert_same_coords(compiled, legacy):
+    compiled.calc_coords()
+    legacy.calc_coords()
+    legacy_elements = {name: element for element, name in legacy.traverse_model()}
+    elements = list(compiled.traverse_model())
+    assert sorted(name for _, name in elements) == sorted(legacy_elements)
+    for element, name in elements:
+        other = legacy_elements[name]
+        assert sorted(element.mapped_vectors) == sorted(other.mapped_vectors)
+        for key, vector in element.mapped_vectors.items():
+            np.testing.assert_allclose(vector, other.mapped_vectors[key], rtol=0, atol=1e-9,
+                                       err_msg=name + ':' + key)
+
+
+def _set_random_angles(models, rng):
+    joints = sorted(name for element, name in models[0].traverse_model() if isinstance(element, RotationJoint))
+    angles = rng.uniform(-np.pi, np.pi, len(joints))
+    for model in models:
+        for name, angle in zip(joints, angles):
+            model.get(name).angle = angle
+
+
+def _add_arm(models, name, position):
+    arm = get_robot_arm(name)
+    for model in models:
+        body = model.get('body')
+        body.add_connection_point(name, np.array(position))
+        body.add(copy.deepcopy(arm), connection_point=name)
+
+
+def test_random_angles():
+    models = _models()
+    rng = np.random.default_rng(0)
+    _assert_same_coords(*models)
+    for _ in range(20):
+        _set_random_angles(models, rng)
+        _assert_same_coords(*models)
+
+    # a single joint changed, only its subtree is recalculated by the compiled model
+    for model in models:
+        model.get('body.left_arm.shoulder_joint1.shoulder_joint2').angle = 0.3
+    _assert_same_coords(*models)
+
+
+def test_subtree_and_model_transforms():
+    models = _models()
+    rng = np.random.default_rng(1)
+    _set_random_angles(models, rng)
+    _assert_same_coords(*models)
+
+    subtree = Transform.rotation(np.array([0.0, 0.0, 1.0]), 0.7, np.array([10.0, 0.0, 5.0])) @ \
+        Transform.translation(np.array([3.0, -2.0, 1.0]))
+    for model in models:
+        model.get('body.left_arm').transform(subtree)
+    _assert_same_coords(*models)
+
+    whole = Transform.scale(1.5) @ Transform.rotation(np.array([1.0, 0.0, 0.0]), -0.4)
+    for model in models:
+        model.transform(whole)
+    _assert_same_coords(*models)
+
+    _set_random_angles(models, rng)
+    _assert_same_coords(*models)
+
+
+def test_added_arms():
+    models = _models()
+    rng = np.random.default_rng(2)
+    _set_random_angles(models, rng)
+    _assert_same_coords(*models)
+
+    for i in range(3):
+        _add_arm(models, 'extra_arm' + str(i), [-80 + 20 * i, 0, 0])
+        _assert_same_coords(*models)
+    _set_random_angles(models, rng)
+    _assert_same_coords(*models)
+
+
+def test_remove_shapes():
+    models = _models()
+    rng = np.random.default_rng(3)
+    _set_random_angles(models, rng)
+    _assert_same_coords(*models)
+
+    for model in models:
+        model.remove_shapes()
+    _assert_same_coords(*models)
+    _set_random_angles(models, rng)
+    _assert_same_coords(*models)
@@ -0,0 +1,48 @@
+import numpy as np
+from model.ik_cache import SolutionCache
+from model.robot import build_model, arm_inverse_kinematics, arm_joint_names
+
+
+def _colliding_angles(ik, rng):
+    view = ik.solver_view()
+    for _ in range(1000):
+        angles = rng.uniform(-np.pi, np.pi, len(view.params))
+        angles = view.constraints.clip(angles)
+        if not view.constraints.valid(angles)[0]:
+            return angles
+    raise AssertionError('no colliding pose found')
+
+
+def test_colliding_solutions_are_misses():
+    model = build_model()
+    cache = SolutionCache()
+    ik = arm_inverse_kinematics(model, 'left', seed=0, solver='dls', cache=cache, self_collision=True)
+    view = ik.solver_view()
+    key = (view.target_position, ik.joint_names, ik.source_element, ik.source_connection_point)
+    constraints = view.constraints.key()
+
+    # e.g. solved while the links it collides with now were posed elsewhere
+    colliding = _colliding_angles(ik, np.random.default_rng(0))
+    cache.store(*key, angles=colliding, constraints=constraints)
+    result = ik.search()
+    assert ik.last_stats.stop_reason != 'cache_hit'
+    assert cache.stats()['rejected'] == 2
+    assert cache.stats()['hits'] == 0
+    angles = [p.angle for p in sorted(result, key=lambda p: p.joint_name)]
+    assert view.constraints.valid(angles)[0]
+
+    # the valid result replaced it and is a hit now
+    ik.search()
+    assert ik.last_stats.stop_reason == 'cache_hit'
+
+
+def test_lookup_valid():
+    cache = SolutionCache(warm_start_distance=5.0)
+    key = ([1.0, 2.0, 3.0], sorted(arm_joint_names('left')), 'source', 'joint')
+    cache.store(*key, angles=[0.1, 0.2, 0.3, 0.4])
+    assert cache.lookup(*key, valid=lambda a: False) is None
+    assert cache.warm_start([2.0, 2.0, 3.0], *key[1:], valid=lambda a: False) is None
+    assert np.allclose(cache.lookup(*key, valid=lambda a: True), [0.1, 0.2, 0.3, 0.4])
+    assert np.allclose(cache.warm_start([2.0, 2.0, 3.0], *key[1:]), [0.1, 0.2, 0.3, 0.4])
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['rejected'], stats['warm_starts']) == (1, 1, 2, 1)
@@ -0,0 +1,47 @@
+import numpy as np
+from model import analytic_ik
+from model.ik_cache import SolutionCache
+from model.robot import build_model, arm_inverse_kinematics
+from model.transformations import get_translation_transform
+
+
+def test_deadline_spent_in_setup():
+    for solver in ('beam', 'dls'):
+        model = build_model()
+        cache = SolutionCache()
+        ik = arm_inverse_kinematics(model, 'left', seed=0, solver=solver, cache=cache, self_collision=True)
+        view = ik.solver_view()
+        cache.store(view.target_position, ik.joint_names, ik.source_element, ik.source_connection_point,
+                    angles=np.zeros(len(view.params)), constraints=view.constraints.key())
+
+        result = ik.search(deadline=0)
+        stats = ik.last_stats
+        assert stats.stop_reason == 'deadline'
+        # neither the cached solution nor a candidate was checked against the constraints
+        assert 'constraints' not in stats.phase_times
+        assert cache.stats()['hits'] + cache.stats()['misses'] == 0
+        base_angles = sorted((p.joint_name, p.base_angle) for p in view.params)
+        assert sorted((p.joint_name, p.angle) for p in result) == base_angles
+
+
+def test_analytic_match_shared_by_snapshots(monkeypatch):
+    matches = []
+    match = analytic_ik.AnalyticArmSolver.match
+    monkeypatch.setattr(analytic_ik.AnalyticArmSolver, 'match',
+                        staticmethod(lambda chain: matches.append(chain) or match(chain)))
+    model = build_model()
+    ik = arm_inverse_kinematics(model, 'left', seed=0, solver='analytic')
+
+    # e.g. BackgroundInverseKinematics, every search on a new snapshot of the view
+    for _ in range(3):
+        ik.search(view=ik.snapshot_view())
+        assert ik.last_stats.stop_reason == 'closed_form'
+    assert len(matches) == 1
+    solver = ik.view.get_analytic_solver()
+    shoulder = np.copy(solver.shoulder)
+
+    model.transform(get_translation_transform([10.0, 0.0, 0.0]))
+    ik.search(view=ik.snapshot_view())
+    assert len(matches) == 2
+    # the earlier match kept its own copy of the geometry
+    assert np.array_equal(solver.shoulder, shoulder)
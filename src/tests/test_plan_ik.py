@@ -0,0 +1,27 @@
+import csv
+import numpy as np
+from benchmarks.ik_solvers import random_reachable_targets, residual
+from model.robot import build_model, arm_joint_names
+from plan_ik import plan
+
+
+def test_non_integer_targets(tmp_path):
+    # reachable, and well away from integer coordinates
+    targets = np.round(random_reachable_targets(build_model(), 'left', 6, seed=3)) + [0.3, -0.45, 0.7]
+    targets_path = str(tmp_path / 'targets.npy')
+    output_path = str(tmp_path / 'solutions.csv')
+    np.save(targets_path, targets)
+    assert plan(targets_path, output_path, solver='analytic', workers=1, chunk_size=4) == len(targets)
+
+    joint_names = sorted(arm_joint_names('left'))
+    with open(output_path) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == len(targets)
+    model = build_model()
+    for position, row in zip(targets, rows):
+        for name in joint_names:
+            model.get(name).angle = float(row[name])
+        # the reported residual is the distance to the requested target
+        distance = residual(model, 'left', position)
+        assert abs(distance - float(row['residual'])) < 1e-4
+        assert distance < 1e-3
@@ -0,0 +1,115 @@
+import time
+import numpy as np
+from control.loop import ControlLoop
+from hardware.servo import ServoChannel
+from hardware.simulated import SimulatedDevice
+from model.robot import build_model, arm_inverse_kinematics, arm_joint_names
+
+CHANNELS = {'a': 0, 'b': 1, 'c': 2}
+
+
+def _open(channel_map=CHANNELS):
+    device = SimulatedDevice(len(channel_map))
+    return device, ServoChannel.open(device.port, channel_map)
+
+
+def test_frame_contents():
+    device, servo = _open()
+    try:
+        servo.set_angles({'a': 0.25, 'b': -1.5, 'c': 3.1, 'unknown': 7.0})
+        assert servo.tick()
+        servo.set_angles({'b': 2.0})
+        assert servo.tick()
+        frames = device.received_commands()
+        assert frames['seq'].tolist() == [0, 1]
+        assert np.array_equal(frames['angles'], np.array([[0.25, -1.5, 3.1], [0.25, 2.0, 3.1]], dtype=np.float32))
+        assert len(device.received) == 2 * servo.frame_format.size
+    finally:
+        servo.close()
+        device.close()
+
+
+def test_no_frame_before_every_channel_is_commanded():
+    device, servo = _open()
+    try:
+        servo.set_angles({'a': 1.0, 'b': 2.0})
+        assert not servo.tick()
+        assert len(device.received_commands()) == 0
+        assert servo.stats()['uncommanded_channels'] == 1
+
+        servo.set_angles({'c': 3.0})
+        assert servo.tick()
+        assert device.received_commands()['angles'].tolist() == [[1.0, 2.0, 3.0]]
+    finally:
+        servo.close()
+        device.close()
+
+
+def test_coalescing():
+    device, servo = _open()
+    try:
+        # different channels set in the same tick, e.g. both arms, are not coalesced
+        servo.set_angles({'a': 1.0, 'b': 1.0})
+        servo.set_angles({'c': 1.0})
+        assert servo.commands_coalesced == 0
+        servo.set_angles({'a': 2.0})
+        servo.set_angles({'a': 3.0, 'c': 4.0})
+        assert servo.commands_coalesced == 3
+        assert servo.tick()
+        # sent values are not pending anymore
+        servo.set_angles({'a': 5.0})
+        assert servo.commands_coalesced == 3
+        assert servo.tick()
+        # nothing new, the last command is repeated
+        assert servo.tick()
+        assert device.received_commands()['angles'].tolist() == [[3.0, 1.0, 4.0], [5.0, 1.0, 4.0], [5.0, 1.0, 4.0]]
+    finally:
+        servo.close()
+        device.close()
+
+
+def test_back_pressure():
+    device, servo = _open()
+    try:
+        servo.set_angles({'a': 0.0, 'b': 0.0, 'c': 0.0})
+        # the device does not read, so the port fills up
+        ticks = 0
+        while servo.frames_dropped == 0:
+            servo.set_angles({'a': float(ticks)})
+            servo.tick()
+            ticks += 1
+            assert ticks < 100000
+        assert servo.frames_sent + servo.frames_dropped == ticks
+        assert servo.stats()['pending_bytes'] > 0
+
+        # once the port is drained the partial frame is completed before the next one
+        device.receive()
+        servo.set_angles({'a': -1.0})
+        assert servo.tick()
+        frames = device.received_commands()
+        assert frames['seq'].tolist() == list(range(servo.frames_sent))
+        assert frames['angles'][-1].tolist() == [-1.0, 0.0, 0.0]
+        assert len(device.received) == servo.frames_sent * servo.frame_format.size
+    finally:
+        servo.close()
+        device.close()
+
+
+def test_control_loop_holds_the_pose_of_unsolved_joints():
+    model = build_model()
+    names = sorted(arm_joint_names('left'))
+    for i, name in enumerate(names):
+        model.get(name).angle = 0.1 * (i + 1)
+    device, servo = _open({name: i for i, name in enumerate(names)})
+    try:
+        loop = ControlLoop(model, [arm_inverse_kinematics(model, 'left', seed=0)], servo=servo)
+        # a deadline already passed, the search is skipped
+        loop.tick(deadline=time.monotonic() - 1)
+        assert loop.searches_skipped == 1
+        frames = device.received_commands()
+        assert len(frames) == 1
+        assert np.allclose(frames['angles'], [[0.1, 0.2, 0.3, 0.4]])
+        assert servo.commands_coalesced == 0
+    finally:
+        servo.close()
+        device.close()
@@ -0,0 +1,42 @@
+import copy
+import pickle
+import numpy as np
+from model.robot import build_model, hand_target_name
+from model.transformations import Transform
+
+
+def test_set_position_keeps_fractions():
+    # a fresh model, its vectors are not in a vertex pool yet
+    model = build_model()
+    position = [32.7, 21.5, 110.9]
+    target = model.get(hand_target_name('left'))
+    target.set_position(position)
+    assert np.array_equal(target.vectors['position'], [position])
+    model.calc_coords()
+    assert np.allclose(target.mapped_vectors['position'], [position])
+
+
+def test_transform_keeps_fractions():
+    model = build_model()
+    arm = model.get('body.left_arm')
+    joint = arm.get('shoulder_joint1')
+    bone = arm.get('shoulder_joint1.shoulder_joint2.shoulder_joint3.upper_arm')
+    origin = joint.vectors['origin'] + 0.25
+    point = bone.vectors['connection_point:joint'] + 0.25
+    arm.transform(Transform.translation(np.array([0.25, 0.25, 0.25])))
+    assert np.array_equal(joint.vectors['origin'], origin)
+    assert np.array_equal(bone.vectors['connection_point:joint'], point)
+
+
+def test_copies_build_their_own_vertex_pool():
+    model = build_model().compile()
+    model.calc_coords()
+    pool = model.get_vertex_pool()
+    position = model.get(hand_target_name('left')).vectors['position'].copy()
+    for other in (copy.deepcopy(model), pickle.loads(pickle.dumps(model))):
+        assert other.vertex_pool is None and other.kinematic_tree is None
+        other.get(hand_target_name('left')).set_position([1.5, 2.5, 3.5])
+        other.calc_coords()
+        assert not np.shares_memory(other.get_vertex_pool().source, pool.source)
+        assert np.allclose(other.get(hand_target_name('left')).mapped_vectors['position'], [[1.5, 2.5, 3.5]])
+        assert np.array_equal(model.get(hand_target_name('left')).vectors['position'], position)
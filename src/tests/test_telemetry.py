@@ -0,0 +1,117 @@
+import numpy as np
+from hardware.framing import command_format, telemetry_format
+from hardware.simulated import SimulatedDevice
+from hardware.telemetry import RingBuffer, TelemetryReader
+from model.robot import build_model, arm_joint_names
+
+
+def _telemetry(n_channels, seq):
+    angles = np.arange(len(seq) * n_channels, dtype=np.float32).reshape((len(seq), n_channels)) / 10
+    encoders = np.arange(len(seq) * n_channels, dtype=np.int32).reshape((len(seq), n_channels)) - 7
+    data = telemetry_format(n_channels).encode(seq, timestamp=seq * 1000, angles=angles, encoders=encoders)
+    return data, angles, encoders
+
+
+def test_framing_round_trip():
+    seq = np.arange(65530, 65540)
+    data, angles, encoders = _telemetry(3, seq)
+    frames, consumed = telemetry_format(3).decode(data)
+    assert consumed == len(data)
+    assert frames['seq'].tolist() == (seq & 0xffff).tolist()
+    assert frames['timestamp'].tolist() == (seq * 1000).tolist()
+    assert np.array_equal(frames['angles'], angles)
+    assert np.array_equal(frames['encoders'], encoders)
+
+    commands = np.array([[0.5, -1.25, 3.0]], dtype=np.float32)
+    frames, consumed = command_format(3).decode(command_format(3).encode(4, angles=commands))
+    assert consumed == command_format(3).size
+    assert frames['seq'].tolist() == [4]
+    assert np.array_equal(frames['angles'], commands)
+    # a command frame is no telemetry frame
+    assert len(telemetry_format(3).decode(command_format(3).encode(4, angles=commands))[0]) == 0
+
+
+def test_garbage_and_partial_frames():
+    frame_format = telemetry_format(2)
+    data, angles, _ = _telemetry(2, np.arange(4))
+    size = frame_format.size
+    frame = [data[i * size:(i + 1) * size] for i in range(4)]
+    corrupt = bytearray(frame[2])
+    corrupt[10] ^= 0xff
+    # garbage with sync bytes in it, a truncated frame, a corrupt one and a frame split at the end
+    buffer = b'\xa5\x5a\x01' + frame[0] + b'\x00\xa5' + frame[1][:size // 2] + frame[1] + bytes(corrupt) + \
+        frame[3][:5]
+    frames, consumed = frame_format.decode(buffer)
+    assert frames['seq'].tolist() == [0, 1]
+    assert np.array_equal(frames['angles'], angles[:2])
+
+    # the rest of the split frame completes it on the next read
+    frames, _ = frame_format.decode(buffer[consumed:] + frame[3][5:])
+    assert frames['seq'].tolist() == [3]
+    assert np.array_equal(frames['angles'], angles[3:])
+
+
+def test_ring_buffer_wrap_around():
+    frame_format = telemetry_format(2)
+    buffer = RingBuffer(5, 2)
+    for start, n in ((0, 3), (3, 4), (7, 1)):
+        frames, _ = frame_format.decode(_telemetry(2, np.arange(start, start + n))[0])
+        buffer.extend(frames, received=float(start))
+    assert len(buffer) == 5
+    last = buffer.last()
+    assert last['seq'].tolist() == [3, 4, 5, 6, 7]
+    assert last['received'].tolist() == [3, 3, 3, 3, 7]
+    assert buffer.last(2)['seq'].tolist() == [6, 7]
+
+    # more frames than fit, only the newest are kept
+    frames, _ = frame_format.decode(_telemetry(2, np.arange(8, 20))[0])
+    buffer.extend(frames, received=8.0)
+    assert buffer.last()['seq'].tolist() == [15, 16, 17, 18, 19]
+    assert np.array_equal(buffer.last()['angles'], frames['angles'][-5:])
+
+
+def _poll(device, reader, n_frames):
+    # the device only writes what the port takes, the rest follows as the reader drains it
+    for _ in range(10000):
+        device.pump()
+        reader.poll()
+        if reader.frames >= n_frames and not device.outgoing:
+            return
+    raise AssertionError('telemetry did not arrive')
+
+
+def test_apply_to_model():
+    names = sorted(arm_joint_names('left'))
+    device = SimulatedDevice(len(names))
+    reader = TelemetryReader.open(device.port, names)
+    try:
+        model = build_model()
+        assert not reader.apply_to_model(model)
+
+        angles = np.linspace(-0.5, 0.5, 3 * len(names)).reshape((3, len(names)))
+        device.send_telemetry(angles)
+        _poll(device, reader, 3)
+        assert reader.apply_to_model(model)
+        for name, angle in zip(names, angles[-1]):
+            assert np.isclose(model.get(name).angle, angle, atol=1e-6)
+    finally:
+        reader.close()
+        device.close()
+
+
+def test_send_more_than_the_port_buffer():
+    names = sorted(arm_joint_names('left'))
+    device = SimulatedDevice(len(names))
+    reader = TelemetryReader.open(device.port, names, capacity=2000)
+    try:
+        angles = np.random.default_rng(0).uniform(-1, 1, (1000, len(names)))
+        device.send_telemetry(angles)
+        _poll(device, reader, 1000)
+        assert reader.stats() == {'frames': 1000,
+                                  'bytes_read': 1000 * reader.frame_format.size,
+                                  'bytes_dropped': 0,
+                                  'seq_gaps': 0}
+        assert np.array_equal(reader.buffer.last()['angles'], angles.astype(np.float32))
+    finally:
+        reader.close()
+        device.close()